@@ -16,10 +16,12 @@
 # along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
 
 from src.DungeonMaster import DungeonMaster
+from src.DungeonMaster import GameOver
 from src.DungeonUI import DungeonUI
 from src.Keys import KeyConfigReader
 
-from sys import setcheckinterval
+from sys import argv
+from sys import stdout
 #import profile
 
 VERSION = '0.5.0'
@@ -36,7 +38,28 @@ if keys.error_count > 0:
         print(e + '\n')
     exit()
 
-dui = DungeonUI(VERSION, keymap)        
+# crashRun.py --headless [script] plays a game with no window, at full speed,
+# using the keys listed in the script file. Without a script, a bot mashes 
+# keys for BOT_KEYSTROKES keystrokes. What the player would have read is 
+# written to stdout.
+BOT_KEYSTROKES = 5000
+
+if '--headless' in argv:
+    from src.HeadlessGuts import HeadlessGuts
+    from src.HeadlessGuts import keys_from_script
+    from src.HeadlessGuts import random_keys
+
+    args = argv[argv.index('--headless') + 1:]
+    if len(args) > 0:
+        script = keys_from_script(args[0])
+    else:
+        script = random_keys(keymap, BOT_KEYSTROKES)
+    dui = DungeonUI(VERSION, keymap, HeadlessGuts(24, 80, script, stdout))
+else:
+    dui = DungeonUI(VERSION, keymap)        
 dm = DungeonMaster(VERSION)
-dm.start_game(dui)
+try:
+    dm.start_game(dui)
+except GameOver:
+    pass
 #profile.run('dm.start_game()')
@@ -15,16 +15,18 @@
 # You should have received a copy of the GNU General Public License
 # along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
 
-from collections import deque
 from copy import copy
+from heapq import heappop
+from heapq import heappush
+from math import sqrt
 from random import choice
 from random import randrange
 from random import random
 from random import randint
 
 from .BaseTile import BaseTile
+from .FieldOfView import SYMMETRIC_VISION
 from . import Behaviour
-from .FieldOfView import Shadowcaster
 from . import Items
 from .Items import ItemFactory
 from .Inventory import Inventory
@@ -36,9 +38,12 @@ from .Util import convert_locations_to_dir
 from .Util import do_dN
 from .Util import do_d10_roll
 from .Util import get_correct_article
+from .Util import VisualAlert
 from .Behaviour import has_ammo_for
 
 STD_ENERGY_COST = 12
+DIAGONAL_COST = sqrt(2)
+DIAGONAL_EXTRA = DIAGONAL_COST - 1
 
 # This class is an exception raised when a monster makes an illegal move
 class IllegalMonsterMove(Exception):
@@ -92,8 +97,13 @@ class AgentMemory:
     def damaged(self, dm, damage, attacker, attack_type='melee'):
         self.attitude = 'hostile'
                   
+# Paths are searched for with diagonal steps costing sqrt(2) so that the 
+# octile distance is an honest (never too high) estimate of what's left.
+# A path ends on the first square found next to the goal, since the goal is 
+# usually occupied by whoever is being chased. budget caps how many squares
+# get expanded before giving up (None means no limit).
 class AStarPathFactory: 
-    def __init__(self, dm, start, goal, level_num):
+    def __init__(self, dm, start, goal, level_num, budget=None):
         self.__start = start
         self.__goal = goal
         self.start_r = start[0]
@@ -102,37 +112,67 @@ class AStarPathFactory:
         self.goal_c = goal[1]
         self.dm = dm
         self.level_num = level_num
+        self.budget = budget
+        self.expanded = 0
+
+    # Octile distance from (row, col) to the nearest square next to the goal
+    def estimate(self, row, col):
+        _dr = max(abs(row - self.goal_r) - 1, 0)
+        _dc = max(abs(col - self.goal_c) - 1, 0)
+        if _dr < _dc:
+            _dr, _dc = _dc, _dr
+        return _dr + DIAGONAL_EXTRA * _dc
 
     def pop_from_open(self):
-        _cost = self.__open[0][1]
-        _t = 0
-        for j in range(1,len(self.__open)):
-            if self.__open[j][1] < _cost:
-                _t = j
-                _cost = self.__open[j][1]
-        
-        return self.__open.pop(_t)[0]
+        while self.__open:
+            _node = heappop(self.__open)[2]
+            if _node not in self.__closed:
+                return _node
+
+        return None
     
     def not_passable(self, row, col):
         _level = self.dm.dungeon_levels[self.level_num]
-        if not _level.is_clear(row, col) or _level.map[row][col].is_toxic():
+        if not _level.in_bounds(row, col):
+            return True
+
+        _i = row * _level.layer_width + col
+        if not _level.passable[_i] or _level.toxic[_i] or _level.get_occupant(row, col) != '':
             return True
         
         return False
             
+    # With nowhere free next to the goal there's no point looking
+    def goal_boxed_in(self):
+        return all(self.not_passable(self.goal_r + _r, self.goal_c + _c) for _r in (-1, 0, 1) for _c in (-1, 0, 1))
+
     def find_path(self):
+        self.expanded = 0
+
+        if self.goal_boxed_in():
+            return []
+
         self.__visited = {self.__start:(0.0,self.__start)}
-        self.__open = [(self.__start,0)] 
+        self.__closed = set()
+        self.__open = [(self.estimate(self.start_r, self.start_c), 0.0, self.__start)]
         
-        while len(self.__open) > 0:
+        while True:
             current = self.pop_from_open()
+            if current is None:
+                break
+
+            # give up after searched for too long
+            if self.budget is not None and self.expanded >= self.budget:
+                break
+            self.expanded += 1
+            self.__closed.add(current)
 
             for r in (-1,0,1):
                 for c in (-1,0,1):
                     if r == 0 and c == 0: continue
                     successor = (current[0]+r,current[1]+c)
 
-                    if self.not_passable(successor[0], successor[1]):
+                    if successor in self.__closed or self.not_passable(successor[0], successor[1]):
                         continue
                     
                     if successor[0] - self.__goal[0] in (-1,0,1) and successor[1] - self.__goal[1] in (-1,0,1):
@@ -140,17 +180,10 @@ class AStarPathFactory:
                         return self.__build_path(successor)
 
                     # Cost to get to successor via parent
-                    g = 1 + self.__visited[current][0]
-                    h =  successor[0] - self.goal_r + successor[1] - self.goal_c
-                    if h < 0: h *= -1
-                    s_cost = g + h
-
-                    # give up after searched for too long
-                    if successor not in self.__visited:
-                        self.__open.append((successor,s_cost))
-                        self.__visited[successor] = (s_cost,current)
-                    elif s_cost < self.__visited[successor][0]:
-                        self.__visited[successor] = (s_cost,current)
+                    g = self.__visited[current][0] + (1 if r == 0 or c == 0 else DIAGONAL_COST)
+                    if successor not in self.__visited or g < self.__visited[successor][0]:
+                        self.__visited[successor] = (g,current)
+                        heappush(self.__open, (g + self.estimate(successor[0], successor[1]), g, successor))
 
         return []
 
@@ -165,40 +198,163 @@ class AStarPathFactory:
 
         return path
 
-# An algorithm to find the furthest distance from a square on the map.
-def furthest_sqr(level, scary_thing, max_distance, agent):
-    _checked = {}
-    _check = deque()
-    _check.append(scary_thing)
-    _furthest = None
-
-    # Flood-fill the map, calculating distances as we go.
-    _max_d = 0
-    while len(_check) > 0:
-        _loc = _check.pop()
-        if _loc in _checked:
-            continue
-        else:
-            _checked[_loc] = True
-
-        if level.is_clear(_loc[0], _loc[1]):
-            _d = calc_distance(scary_thing[0], scary_thing[1], _loc[0], _loc[1])
-            if _d > _max_d:
-                _furthest = _loc
-                _max_d = _d
-                if _d > max_distance:
-                    return _furthest
-                
-        for r in (-1, 0, 1):
-            for c in (-1, 0, 1):
-                if r == 0 and c == 0:
+# Jump Point Search: the same search over the same grid, except that instead
+# of adding every neighbour of a square to the open list, it runs along each
+# direction worth going in until it hits something that makes a square 
+# interesting (a wall to go around, or the goal) and only adds that. Across 
+# open ground that skips nearly all of the squares plain A* would expand. 
+# Paths are just as short, and budget counts the jump points expanded.
+#
+# The search runs over a copy of the level's walkable grid with the occupied
+# squares blanked out and the squares next to the goal marked, and squares 
+# are referred to by their index in it.
+class JumpPointPathFactory(AStarPathFactory):
+    def find_path(self):
+        self.expanded = 0
+        if self.goal_boxed_in():
+            return []
+
+        _level = self.dm.dungeon_levels[self.level_num]
+        _w = _level.layer_width + 2
+        _grid = bytearray(_level.get_walkable_grid())
+        for _i in _level.occupants:
+            _grid[(_i // _level.lvl_width + 1) * _w + _i % _level.lvl_width + 1] = 0
+        _goal = (self.goal_r + 1) * _w + self.goal_c + 1
+        for _i in (_goal - _w - 1, _goal - _w, _goal - _w + 1, _goal - 1, _goal, 
+                    _goal + 1, _goal + _w - 1, _goal + _w, _goal + _w + 1):
+            if _grid[_i]:
+                _grid[_i] = 2
+        self.__grid = _grid
+        self.__w = _w
+
+        _start = (self.start_r + 1) * _w + self.start_c + 1
+        _visited = {_start:(0.0, None)}
+        _closed = set()
+        _open = [(self.estimate(self.start_r, self.start_c), 0.0, _start)]
+
+        while _open:
+            _current = heappop(_open)[2]
+            if _current in _closed:
+                continue
+            if self.budget is not None and self.expanded >= self.budget:
+                break
+            self.expanded += 1
+            _closed.add(_current)
+
+            _g = _visited[_current][0]
+            _r, _c = divmod(_current, _w)
+            for _dr, _dc in self.__directions(_current, _visited[_current][1]):
+                _jp = self.__jump(_current, _dr, _dc)
+                if _jp is None or _jp in _closed:
                     continue
-                _s = (_loc[0] + r, _loc[1] + c)
-                if not _s in _checked and level.is_clear_for_agent(_s[0], _s[1], agent):
-                    _check.appendleft(_s)
-    
-    return _furthest
-    
+
+                if _grid[_jp] == 2:
+                    _visited[_jp] = (0.0, _current)
+                    return self.__build_path(_visited, _jp)
+
+                _jr, _jc = divmod(_jp, _w)
+                _steps = max(abs(_jr - _r), abs(_jc - _c))
+                _new_g = _g + (DIAGONAL_COST * _steps if _dr and _dc else _steps)
+                if _jp not in _visited or _new_g < _visited[_jp][0]:
+                    _visited[_jp] = (_new_g, _current)
+                    heappush(_open, (_new_g + self.estimate(_jr - 1, _jc - 1), _new_g, _jp))
+
+        return []
+
+    def __direction(self, sqr, parent):
+        _r, _c = divmod(sqr, self.__w)
+        _pr, _pc = divmod(parent, self.__w)
+        return (_r > _pr) - (_r < _pr), (_c > _pc) - (_c < _pc)
+
+    # The directions worth searching from a square, given the way we came
+    # into it: straight on, plus any way around a wall we just passed
+    def __directions(self, sqr, parent):
+        if parent is None:
+            return ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+        _grid = self.__grid
+        _w = self.__w
+        _dr, _dc = self.__direction(sqr, parent)
+        if _dr and _dc:
+            _dirs = [(_dr, _dc), (_dr, 0), (0, _dc)]
+            if not _grid[sqr - _dc]:
+                _dirs.append((_dr, -_dc))
+            if not _grid[sqr - _dr * _w]:
+                _dirs.append((-_dr, _dc))
+        elif _dc:
+            _dirs = [(0, _dc)]
+            if not _grid[sqr + _w]:
+                _dirs.append((1, _dc))
+            if not _grid[sqr - _w]:
+                _dirs.append((-1, _dc))
+        else:
+            _dirs = [(_dr, 0)]
+            if not _grid[sqr + 1]:
+                _dirs.append((_dr, 1))
+            if not _grid[sqr - 1]:
+                _dirs.append((_dr, -1))
+
+        return _dirs
+
+    # Run from sqr in the direction given until reaching a square next to the
+    # goal or one with a forced neighbour (a square that can only be reached 
+    # well by going through this one, because of a wall beside us). Diagonal
+    # runs also stop wherever a straight run from them would find something.
+    # Returns None if we hit a wall first.
+    def __jump(self, sqr, dr, dc):
+        _grid = self.__grid
+        _w = self.__w
+        _step = dr * _w + dc
+        if dr and dc:
+            _back_r = dr * _w
+            while True:
+                sqr += _step
+                _here = _grid[sqr]
+                if not _here:
+                    return None
+                if _here == 2:
+                    return sqr
+                if (not _grid[sqr - dc] and _grid[sqr - dc + _back_r]) or \
+                        (not _grid[sqr - _back_r] and _grid[sqr - _back_r + dc]):
+                    return sqr
+                if self.__jump(sqr, dr, 0) is not None or self.__jump(sqr, 0, dc) is not None:
+                    return sqr
+
+        # Running straight, the squares either side of us
+        _side = 1 if dr else _w
+        while True:
+            sqr += _step
+            _here = _grid[sqr]
+            if not _here:
+                return None
+            if _here == 2:
+                return sqr
+            if (not _grid[sqr + _side] and _grid[sqr + _side + _step]) or \
+                    (not _grid[sqr - _side] and _grid[sqr - _side + _step]):
+                return sqr
+
+    # Fill in the squares between the jump points
+    def __build_path(self, visited, sqr):
+        _path = []
+        while visited[sqr][1] is not None:
+            _parent = visited[sqr][1]
+            _dr, _dc = self.__direction(sqr, _parent)
+            _step = _dr * self.__w + _dc
+            while sqr != _parent:
+                _r, _c = divmod(sqr, self.__w)
+                _path.append((_r - 1, _c - 1))
+                sqr -= _step
+
+        _path.reverse()
+        return _path
+
+# Open levels (the fields outside the complex, the proving grounds) get Jump 
+# Point Search, everywhere else the plain A* search does better.
+def path_factory(dm, start, goal, level_num, budget=None):
+    if dm.dungeon_levels[level_num].is_open_ground():
+        return JumpPointPathFactory(dm, start, goal, level_num, budget)
+    return AStarPathFactory(dm, start, goal, level_num, budget)
+
 class BaseAgent(BaseTile):
     ENERGY_THRESHOLD = 12
     
@@ -267,6 +423,8 @@ class BaseAgent(BaseTile):
                 self.light_radius += e[1]
         elif e[0] == 'clear-head':
             self.remove_condition_type('dazed')
+        elif e[0] in ('speed', 'stunned'):
+            self.timing_changed()
         elif e[0] == 'chutzpah' and hasattr(self, 'stats'):
             self.stats.change_stat('chutzpah',e[1])
         elif e[0] == 'co-ordination' and hasattr(self,'stats'):
@@ -471,6 +629,8 @@ class BaseAgent(BaseTile):
             elif effect[0] in ('chutzpah','co-ordination','strength') and hasattr(self,'stats'):
                 self.stats.change_stat(effect[0],-effect[1])
                 self.calc_ac()
+            elif effect[0] in ('speed', 'stunned'):
+                self.timing_changed()
                 
     def remove_effects(self, source):
         [self.remove_effect(e, source) for e in source.effects]
@@ -523,6 +683,16 @@ class BaseAgent(BaseTile):
             
     def sum_effect_bonuses(self, effect):
         return sum([_c[0][1] for _c in self.conditions if _c[0][0] == effect], 0)
+
+    # Speeding up, slowing down or being stunned changes when an agent next
+    # gets to act, so its level's scheduler needs to hear about it. (Agents 
+    # that aren't on a level yet, or the player, aren't in any scheduler)
+    def timing_changed(self):
+        try:
+            _lvl = self.dm.dungeon_levels[self.curr_level]
+        except (AttributeError, KeyError):
+            return
+        _lvl.scheduler.reschedule(self)
         
     def temp_reduce_vision(self,new_vr):
         self.__std_vision_radius = self.vision_radius
@@ -543,6 +713,19 @@ class BaseAgent(BaseTile):
         
 # Method for moving and following using A*
 class AStarMover:
+    # move_to() only chases things within 10 squares, so it doesn't need 
+    # to look at much of the map to find a way there. (Chasing the player
+    # goes through the level's shared distance field instead, see chase())
+    MOVE_TO_BUDGET = 400
+
+    # How far along a path from the level's path cache to check for anyone 
+    # standing in the way before setting off on it
+    PATH_STEPS_CHECKED = 4
+
+    # Trips at least this far on levels with a room graph are planned room by
+    # room
+    ROOM_ROUTE_DISTANCE = 15
+
     def __init__(self, dm):
         self.dm = dm
         self.moves = []
@@ -557,9 +740,7 @@ class AStarMover:
     # player?
     def move_to(self, goal):
         if len(self.moves) == 0 and self.distance(goal) <= 10:
-            _start = (self.row,self.col)
-            _as = AStarPathFactory(self.dm, _start, goal, self.curr_level)
-            self.moves = _as.find_path()[:4]
+            self.moves = self.__plan_path(goal, self.MOVE_TO_BUDGET)[:4]
 
         if len(self.moves) > 0:
             _move = self.moves.pop(0)
@@ -570,11 +751,134 @@ class AStarMover:
                 # new path
                 self.moves = []
     
+    # Path from where we are to next to goal, reusing what's in the level's
+    # path cache where possible
+    def __plan_path(self, goal, budget=None):
+        _cache = self.dm.dungeon_levels[self.curr_level].path_cache
+        _start = (self.row, self.col)
+        _goal = (goal[0], goal[1])
+
+        _path = _cache.lookup(_start, _goal)
+        if _path:
+            _path = self.__repair_path(_cache, _start, _goal, _path, budget)
+            if _path:
+                return _path
+
+        _cache.misses += 1
+        _path = self.__route_path(_cache, _start, _goal, budget)
+        if _path is None:
+            _as = path_factory(self.dm, _start, _goal, self.curr_level, budget)
+            _path = _as.find_path()
+            _cache.searched += _as.expanded
+        if _path:
+            _cache.store(_start, _goal, _path)
+
+        return _path
+
+    # Long trips across levels with a room graph are first planned as a list of
+    # crossings between rooms, then walked out one leg at a time, each being
+    # a short search within a room. Returns an empty path if the room graph
+    # shows there's no way there, and None if a plain search is needed: there's
+    # no room graph (or it's open ground, where the search is cheap anyway), 
+    # the trip is too short to bother, or a leg can't be found.
+    def __route_path(self, cache, start, goal, budget):
+        _lvl = self.dm.dungeon_levels[self.curr_level]
+        if max(abs(start[0] - goal[0]), abs(start[1] - goal[1])) < self.ROOM_ROUTE_DISTANCE:
+            return None
+        if _lvl.is_open_ground():
+            return None
+        _graph = _lvl.get_room_graph()
+        if _graph is None:
+            return None
+        _route = _graph.route(start, goal)
+        if _route is None or _route == []:
+            return _route
+
+        _path = []
+        _from = start
+        for _waypoint in _route + [goal]:
+            # Next to it is as good as there
+            if max(abs(_from[0] - _waypoint[0]), abs(_from[1] - _waypoint[1])) <= 1:
+                continue
+            _as = path_factory(self.dm, _from, _waypoint, self.curr_level, budget)
+            _leg = _as.find_path()
+            cache.searched += _as.expanded
+            if not _leg:
+                return None
+            _path += _leg
+            _from = _leg[-1]
+
+        return _path
+
+    # Check the first few steps of a cached path are clear. If someone's in the
+    # way, only search for a way around them back onto the path rather than 
+    # for the whole thing again. Returns None if there's no getting around.
+    def __repair_path(self, cache, start, goal, path, budget):
+        _lvl = self.dm.dungeon_levels[self.curr_level]
+        _blocked = None
+        for _i in range(min(len(path), self.PATH_STEPS_CHECKED)):
+            if not _lvl.is_clear(path[_i][0], path[_i][1]):
+                _blocked = _i
+                break
+
+        if _blocked is None:
+            cache.hits += 1
+            return path
+
+        _rejoin = _blocked + 1
+        while _rejoin < len(path) and not _lvl.is_clear(path[_rejoin][0], path[_rejoin][1]):
+            _rejoin += 1
+        if _rejoin == len(path):
+            # Nothing clear past the blockage, so get as close as we can and
+            # wait our turn
+            if _blocked == 0:
+                return None
+            cache.repairs += 1
+            return path[:_blocked]
+
+        _as = path_factory(self.dm, start, path[_rejoin], self.curr_level, budget)
+        _detour = _as.find_path()
+        cache.searched += _as.expanded
+        if not _detour:
+            return None
+
+        # The detour ends beside the square it was headed for, which may be 
+        # further along the path
+        _rest = path[_rejoin:]
+        if _detour[-1] in _rest:
+            _rest = _rest[_rest.index(_detour[-1]) + 1:]
+        cache.repairs += 1
+        cache.store(start, goal, _detour + _rest)
+
+        return _detour + _rest
+
+    # Go after the target. If it's the player, follow the distance field the
+    # level keeps leading to them, which every monster after the player shares 
+    # and which costs nothing extra however far away they are. Anything else,
+    # or if the field doesn't have a way forward, falls back to move_to().
+    def chase(self, target):
+        _goal = (target.row, target.col, target.curr_level)
+        if target.curr_level != self.curr_level or \
+                (target != self.dm.player and target != self.dm.get_true_player()):
+            self.move_to(_goal)
+            return
+
+        _lvl = self.dm.dungeon_levels[self.curr_level]
+        _field = _lvl.get_distance_field(target.row, target.col)
+        _sqr = _field.downhill(_lvl, self.row, self.col)
+        if _sqr == None:
+            self.move_to(_goal)
+            return
+
+        self.moves = []
+        try:
+            self.dm.move_monster(self, _sqr[1] - self.col, _sqr[0] - self.row)
+        except IllegalMonsterMove:
+            pass
+
     def move_to_unbound(self, goal):
         if not self.moves:
-            _start = (self.row, self.col)
-            _as = AStarPathFactory(self.dm, _start, goal, self.curr_level)
-            self.moves = _as.find_path()
+            self.moves = self.__plan_path(goal)
             if not self.moves:
                 return False
                 
@@ -590,6 +894,10 @@ class AStarMover:
                 return False
                 
 class BaseMonster(BaseAgent, AStarMover):
+    # Monsters that never leave their square. (A class attribute, so monsters
+    # from games saved before it existed have it too)
+    stationary = False
+
     def __init__(self, vision_radius, ac, hp_low, hp_high, dmg_dice, dmg_rolls, ab, dm, ch, 
                 fg, bg, lit, name, row, col, xp_value, gender, level):
         BaseAgent.__init__(self, vision_radius, ac, dmg_dice, dmg_rolls, ch, fg, bg, lit,
@@ -610,6 +918,7 @@ class BaseMonster(BaseAgent, AStarMover):
         _level.melee.attack(self, _level.get_occupant(loc[0], loc[1]))
         
     def damaged(self, dm, damage, attacker, attack_type='melee'):        
+        self.wake_up()
         self.last_attacker = attacker
         self.attitude = 'hostile'
         super(BaseMonster, self).damaged(dm, damage, attacker, attack_type)
@@ -662,9 +971,8 @@ class BaseMonster(BaseAgent, AStarMover):
 
         d = calc_distance(self.row, self.col, agent.row , agent.col)
         if d <= self.vision_radius:
-            sc = Shadowcaster(self.dm, self.vision_radius, self.row, self.col, self.curr_level)
-            mv = sc.calc_visible_list()
-            return (agent.row, agent.col) in mv
+            _lvl = self.dm.dungeon_levels[self.curr_level]
+            return _lvl.can_see(self.vision_radius, self.row, self.col, agent.row, agent.col, SYMMETRIC_VISION)
 
         return False
 
@@ -676,14 +984,27 @@ class BaseMonster(BaseAgent, AStarMover):
         d = calc_distance(self.row, self.col, _pl.row , _pl.col)
         _loc = (_pl.row, _pl.col)
         if d <= self.vision_radius:
-            sc = Shadowcaster(self.dm, self.vision_radius, self.row, self.col, self.curr_level)
-            mv = sc.calc_visible_list()
-            return (_pl.row, _pl.col) in mv
+            # Usually answered from the symmetric view cast out from the 
+            # player at the start of the turn (see precompute_monster_vision())
+            _lvl = self.dm.dungeon_levels[self.curr_level]
+            return _lvl.can_see(self.vision_radius, self.row, self.col, _pl.row, _pl.col, SYMMETRIC_VISION)
 
         return False
                 
     def set_dm_ref(self,dm):
         self.dm = dm
+
+    # Monsters that won't do anything until something disturbs them can be
+    # put to sleep by their level, so they don't cost anything each turn
+    def is_idle(self):
+        return False
+
+    def wake_up(self):
+        try:
+            _lvl = self.dm.dungeon_levels[self.curr_level]
+        except (AttributeError, KeyError):
+            return
+        _lvl.wake_monster(self)
         
     def react_to_noise(self, noise):
         if self.attitude == 'inactive':
@@ -691,6 +1012,7 @@ class BaseMonster(BaseAgent, AStarMover):
             
             if _roll < noise.volume:
                 self.attitude = 'hostile'
+                self.wake_up()
                 return True
         
             return False
@@ -702,6 +1024,7 @@ class BaseMonster(BaseAgent, AStarMover):
 
     def attacked_by(self, attacker):
         self.attitude = 'hostile'
+        self.wake_up()
 
 # This class can be used for monsters such as wolves which will move towards the player
 # and attack. 
@@ -712,6 +1035,9 @@ class AltPredator(BaseMonster):
             dm, ch, fg, bg, lit, name, row, col, xp_value, gender, level)
         self.state = ''
 
+    def is_idle(self):
+        return self.attitude == 'inactive'
+
     # I want to make this a little more sophisticated. A monster should remember beings it has
     # been hurt by, and make attacking them a precedent over attacking the player. So their priority
     # in this case would be: (1) attack someone who has hurt me (2) look for the player and go after them.
@@ -736,32 +1062,46 @@ class AltPredator(BaseMonster):
             if self.is_agent_adjacent(_target):
                 self.attack(_target_loc)
             else:
-                self.move_to(_target_loc)
+                self.chase(_target)
         except MoraleCheckFailed:
             if self.state != 'scared':
                 self.dm.alert_player(self.row,self.col,'The ' + self.get_name() +' turns to flee!')
                 self.state = 'scared'
             
             _lvl = self.dm.dungeon_levels[self.curr_level]
-            if not hasattr(self, "flee_to") or self.distance(_target_loc) < 3:
-                self.flee_to = furthest_sqr(_lvl, _target_loc, 25, self)
-            
-            if self.flee_to == None:
-                va = VisualAlert(self.row, self.col, self.get_name(1) + " panics.", "", _lvl)
+            fled = self.__flee(_lvl, _target)
+            if not fled:
+                va = VisualAlert(self.row, self.col, self.get_name(1) + " panics.", "")
                 va.show_alert(self.dm, False)
-                fled = False
-            else:
-                fled = self.move_to_unbound(self.flee_to)
                 
             if not fled and self.is_agent_adjacent(_target):
                 self.attack(_target_loc)
             
         self.energy -= STD_ENERGY_COST
         
+    # Every monster running from the same thing follows the level's safety map
+    # for it, which gets them away from it and out past it if that's the 
+    # better bet, rather than into a corner. Returns False if there's nowhere
+    # better to go.
+    def __flee(self, level, threat):
+        if threat.curr_level != self.curr_level:
+            return False
+
+        _sqr = level.get_safety_map(threat.row, threat.col).downhill(level, self.row, self.col)
+        if _sqr == None:
+            return False
+
+        self.moves = []
+        try:
+            self.dm.move_monster(self, _sqr[1] - self.col, _sqr[0] - self.row)
+            return True
+        except IllegalMonsterMove:
+            return False
+
     def __check_morale(self):
         fear_factor = float(self.curr_hp) / float(self.max_hp)
         if fear_factor > 0.1 and self.curr_hp > 2:
-            self.state == ''
+            self.state = ''
             return
             
         if self.state == 'scared':
@@ -810,6 +1150,10 @@ class HumanFoe(AltPredator):
             fg, bg, lit, name, row, col, xp_value, gender, level):
         AltPredator.__init__(self, vision_radius, ac, hp_low, hp_high, dmg_dice, dmg_rolls, ab, 
             dm, ch, fg, bg, lit, name, row, col, xp_value, gender, level)
+
+    # Even inactive, they'll put on any armour they're carrying
+    def is_idle(self):
+        return AltPredator.is_idle(self) and len(Behaviour.pick_armour(self)) == 0
     
     def should_put_on_armour(self, pieces):
         if len(pieces) == 0:
@@ -1028,7 +1372,7 @@ class BelligerentProcess(CyberspaceMonster):
             if randrange(5) == 0: self.fork()
             self.attack(player_loc)
         else:
-            self.move_to(player_loc)
+            self.chase(self.dm.player)
 
         self.energy -= STD_ENERGY_COST
 
@@ -1072,7 +1416,7 @@ class RelentlessPredator(BaseMonster):
         if self.is_agent_adjacent_to_loc(target.row, target.col, self):
             self.attack(_loc)
         else:
-            self.move_to(_loc)
+            self.chase(target)
 
     def select_target(self):
         if self.last_attacker != None:
@@ -1133,7 +1477,7 @@ class Shooter(RelentlessPredator):
         else:
             _sqr = self.pick_loc_to_move_to(_loc)
             if _sqr == ():
-                self.move_to(_loc)
+                self.chase(self.target)
             else:
                 self.move_to(_sqr)
             
@@ -1173,6 +1517,8 @@ class Cyborg(Shooter):
             RelentlessPredator.perform_action(self)
 
 class GunTurret(Shooter):
+    stationary = True
+
     def __init__(self, dm, row, col):
         Shooter.__init__(self, vision_radius=5, ac=20, hp_low=35, hp_high=45, dmg_dice=4, dmg_rolls=3, ab=3,
             dm=dm,ch='t', fg='grey', bg='black', lit='white', name='Gun Turret', row=row,
@@ -1268,7 +1614,7 @@ class Ninja(RelentlessPredator):
                 self.__hop(player_loc)
             self.attack(player_loc)
         else:
-            self.move_to(player_loc)
+            self.chase(self.dm.player)
         
         self.energy -= STD_ENERGY_COST
 
@@ -0,0 +1,42 @@
+# Copyright 2010 by Dana Larose
+
+# This file is part of crashRun.
+
+# crashRun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# crashRun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
+
+# Something moving across the screen (a bullet, a thrown item, the front of
+# an explosion), recorded while the game works out what happens rather than
+# the game waiting on the screen for every step. Each frame is the squares 
+# drawn during one step, as the DungeonSqrInfo objects that would have been
+# sent to the display, along with how long to leave the frame up. Finished
+# frames are queued up with the UI, which plays them before the next message
+# (so the player sees the shot before reading what it hit) or once the 
+# animation is over. If show is False, they're just dropped.
+class Animation(object):
+    def __init__(self, dui, show=True):
+        self.dui = dui
+        self.show = show
+        self.touched = set()
+        self.__sqrs = []
+
+    def record(self, level_num, sqr):
+        self.__sqrs.append(sqr)
+        self.touched.add((level_num, sqr.r, sqr.c))
+
+    # Steps nobody could see don't make a frame
+    def end_frame(self, pause):
+        if len(self.__sqrs) > 0:
+            if self.show:
+                self.dui.queue_animation_frame(self.__sqrs, pause)
+            self.__sqrs = []
@@ -0,0 +1,113 @@
+# Copyright 2010 by Dana Larose
+
+# This file is part of crashRun.
+
+# crashRun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# crashRun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
+
+# Explosions fill a volume: the blast floods outward from where the bomb went
+# off, one ring of squares per step, through anything that isn't opaque. Walls,
+# closed doors and the like catch the blast but stop it from going further, so
+# it can roll around a corner but not through a wall.
+
+NEIGHBOURS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+# The parts of a blast that only depend on its radius: which offsets are
+# close enough to the centre to be reached at all, and how much of the blast's
+# force is left after a given number of steps.
+class BlastTemplate(object):
+    def __init__(self, radius):
+        self.radius = radius
+        _radius_sqred = radius * radius
+        self.offsets = frozenset((_dr, _dc) for _dr in range(-radius, radius + 1)
+                                    for _dc in range(-radius, radius + 1)
+                                        if _dr * _dr + _dc * _dc <= _radius_sqred)
+        self.falloff = [float(radius + 1 - _step) / (radius + 1) for _step in range(radius + 1)]
+
+    # Anything the blast reaches takes at least a point of damage, so that
+    # equipment on the edge still gets knocked out.
+    def damage_at(self, dmg, step):
+        if dmg <= 0:
+            return 0
+        return max(1, int(dmg * self.falloff[step]))
+
+blast_templates = {}
+
+def get_blast_template(radius):
+    if radius not in blast_templates:
+        blast_templates[radius] = BlastTemplate(radius)
+    return blast_templates[radius]
+
+# Works out everything a blast touches in a single pass. After construction:
+#   rings: lists of (row, col) by number of steps from the centre
+#   cells: (row, col) -> damage at that square
+#   occupants: (agent, damage) for everyone caught in the blast
+#   terrain: (tile, row, col, damage) for each terrain tile that takes damage,
+#       including a tile a bomb has been placed on top of
+class Blast(object):
+    def __init__(self, level, row, col, radius, dmg):
+        self.row = row
+        self.col = col
+        self.radius = radius
+        self.dmg = dmg
+        self.rings = []
+        self.cells = {}
+        self.occupants = []
+        self.terrain = []
+        self.__propagate(level, get_blast_template(radius))
+
+    def __propagate(self, level, template):
+        _width = level.layer_width
+        _opaque = level.opaque
+        _offsets = template.offsets
+        _frontier = [(self.row, self.col)]
+        self.cells[(self.row, self.col)] = template.damage_at(self.dmg, 0)
+
+        _step = 0
+        while _frontier:
+            self.rings.append(_frontier)
+            for _r, _c in _frontier:
+                self.__caught(level, _r, _c, self.cells[(_r, _c)])
+            _step += 1
+            if _step > template.radius:
+                break
+
+            _dmg = template.damage_at(self.dmg, _step)
+            _next = []
+            for _r, _c in _frontier:
+                # The blast doesn't carry on past something solid, unless the
+                # bomb was sitting on it
+                if _opaque[_r * _width + _c] and (_r, _c) != (self.row, self.col):
+                    continue
+                for _dr, _dc in NEIGHBOURS:
+                    _nr = _r + _dr
+                    _nc = _c + _dc
+                    if (_nr, _nc) in self.cells:
+                        continue
+                    if (_nr - self.row, _nc - self.col) not in _offsets:
+                        continue
+                    if not level.in_bounds(_nr, _nc):
+                        continue
+                    self.cells[(_nr, _nc)] = _dmg
+                    _next.append((_nr, _nc))
+            _frontier = _next
+
+    def __caught(self, level, row, col, dmg):
+        _sqr = level.map[row][col]
+        self.terrain.append((_sqr, row, col, dmg))
+        if hasattr(_sqr, 'previous_tile'):
+            self.terrain.append((_sqr.previous_tile, row, col, dmg))
+
+        _occupant = level.get_occupant(row, col)
+        if _occupant != '':
+            self.occupants.append((_occupant, dmg))
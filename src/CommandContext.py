@@ -19,7 +19,6 @@ import string
 from random import randrange
 
 from .Agent import STD_ENERGY_COST
-from .FieldOfView import Shadowcaster
 from . import Items
 from . import Inventory
 from .Inventory import AlreadyWearingSomething
@@ -323,6 +322,7 @@ class MeatspaceCC(CommandContext):
             self.dui.display_message('The door is already closed!')
         else:
             sqr.opened = False
+            lvl.terrain_changed(row, col)
             self.dm.update_sqr(lvl, row, col)
             self.dm.refresh_player_view()
             self.dui.display_message('You close the door')
@@ -665,8 +665,8 @@ class RemoteRobotCC(MeatspaceCC):
 
     def get_sidebar_view(self):
         meat = self.dm.suspended_player[0]
-        sc = Shadowcaster(self.dm, meat.calc_curr_vision_radius(), meat.row, meat.col, meat.curr_level)
-        visible = sc.calc_visible_list()
+        _lvl = self.dm.dungeon_levels[meat.curr_level]
+        visible = dict(_lvl.calc_visible_list(meat.calc_curr_vision_radius(), meat.row, meat.col))
         visible[(meat.row, meat.col)] = 0
 
         blocks = []
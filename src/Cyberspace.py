@@ -32,6 +32,10 @@ from .Util import do_d10_roll
 
 class TrapSetOff(Exception):
     pass
+
+# Raised if the maze is generated with nowhere left to drop the player in
+class NoEntrySpot(Exception):
+    pass
     
 class CyberspaceLevel(GameLevel):
     def __init__(self, dm, level_num, length, width):        
@@ -208,7 +212,7 @@ class CyberspaceLevel(GameLevel):
             r = randrange(self.lvl_length)
             c = randrange(self.lvl_width)
             
-            if self.map[r][c].get_type() == T.CYBERSPACE_FLOOR:
+            if self.get_tile_type(r, c) == T.CYBERSPACE_FLOOR:
                 self.add_item_to_sqr(r, c, _s)
                 break
 
@@ -291,10 +295,7 @@ class CyberspaceLevel(GameLevel):
         return _m
         
     def __set_entry_spot(self):        
-        while True:
-            r = randrange(1, self.lvl_length-1)
-            c = randrange(1, self.lvl_width-1)
-            
-            if self.is_clear(r, c): 
-                break
-        self.entrance = (r, c)
+        _sqr = self.random_vacant_sqr(True)
+        if _sqr is None:
+            raise NoEntrySpot('No free square for the cyberspace entrance on level %d' % self.level_num)
+        self.entrance = _sqr
@@ -139,6 +139,19 @@ class DisplayGuts(object):
             self.wait_for_key_input()
         self.clear_msg_line()
 
+    # Each frame is a list of squares to draw and how long (in seconds) to 
+    # leave them up. Hitting a key skips the rest of the animation, and the 
+    # key is left in the queue to be read as the next command.
+    def play_animation(self, frames):
+        for _sqrs, _pause in frames:
+            SDL_PumpEvents()
+            if SDL_HasEvent(SDL_KEYDOWN):
+                return
+            for _sqr in _sqrs:
+                self.update_view(_sqr, False)
+            SDL_UpdateWindowSurface(self.window)
+            SDL_Delay(int(_pause * 1000))
+
     def redraw_screen(self):
         if self.map_r != '' and self.map_c != '':
             section = self.cc.get_section(self.map_r,self.map_c,self.map_r+self.display_rows-1,self.map_c+self.display_cols)
@@ -298,7 +311,7 @@ class DisplayGuts(object):
         SDL_FreeSurface(txt)
         SDL_UpdateWindowSurface(self.window)
 
-    def update_view(self, sqr):
+    def update_view(self, sqr, update=True):
         actual_r = sqr.r - self.map_r
         actual_c = sqr.c - self.map_c
 
@@ -307,7 +320,7 @@ class DisplayGuts(object):
         # Note that the first and last rows are reserved for the message bar and status bar
         if actual_r >= 0 and actual_r < self.display_rows and actual_c >= 0 and actual_c < self.display_cols:
             colours = sqr.get_fg_bg()
-            self.write_sqr(sqr.get_ch(),colours[0],colours[1],actual_r,actual_c,True)
+            self.write_sqr(sqr.get_ch(),colours[0],colours[1],actual_r,actual_c,update)
 
     # From what I can tell so far, SDL gives you the raw key pressed and any modifier keys, so for letters you get
     # 'A', 'B' etc so I cast them to lowercase if a shift key isn't being pressed. But I also need to check for characters
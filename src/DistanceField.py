@@ -0,0 +1,129 @@
+# Copyright 2010 by Dana Larose
+
+# This file is part of crashRun.
+
+# crashRun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# crashRun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+from collections import deque
+from heapq import heappop
+from heapq import heappush
+
+UNREACHABLE = 0xFFFF
+UNSAFE = 0x7FFFFFFF
+
+# How much further a fleeing monster will go to get around the threat and out
+# the far side rather than backing into a corner
+FLEE_FACTOR = 1.2
+
+NEIGHBOURS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+# How many moves it takes to get from each square of a level to (row, col),
+# found with a breadth-first flood out from (row, col) over the level's
+# passable, non-toxic squares. Monsters aren't counted as obstacles, since
+# they'll have moved by the time it matters. Anything chasing the target
+# can just keep stepping to a neighbouring square that's closer.
+class DistanceField(object):
+    def __init__(self, level, row, col):
+        self.row = row
+        self.col = col
+        self.width = level.layer_width
+        self.length = level.layer_length
+        self.distances = array('H', [UNREACHABLE]) * (self.width * self.length)
+        self.__flood(level)
+
+    def __flood(self, level):
+        _width = self.width
+        _passable = level.passable
+        _toxic = level.toxic
+        _distances = self.distances
+        _start = self.row * _width + self.col
+        _distances[_start] = 0
+        _queue = deque([(self.row, self.col)])
+
+        while _queue:
+            _r, _c = _queue.popleft()
+            _d = _distances[_r * _width + _c] + 1
+            for _dr, _dc in NEIGHBOURS:
+                _nr = _r + _dr
+                _nc = _c + _dc
+                if _nr < 0 or _nr >= self.length or _nc < 0 or _nc >= _width:
+                    continue
+                _i = _nr * _width + _nc
+                if _distances[_i] != UNREACHABLE or not _passable[_i] or _toxic[_i]:
+                    continue
+                _distances[_i] = _d
+                _queue.append((_nr, _nc))
+
+    def distance(self, row, col):
+        return self.distances[row * self.width + col]
+
+    # The neighbouring square that gets closest to the target and that
+    # nobody's standing on, or None if there's no clear square any closer
+    def downhill(self, level, row, col):
+        _best = None
+        _best_d = self.distance(row, col)
+        for _dr, _dc in NEIGHBOURS:
+            _nr = row + _dr
+            _nc = col + _dc
+            if not level.in_bounds(_nr, _nc):
+                continue
+            _d = self.distance(_nr, _nc)
+            if _d < _best_d and level.is_clear(_nr, _nc):
+                _best = (_nr, _nc)
+                _best_d = _d
+
+        return _best
+
+# The other way round: a map for running away from (row, col). Going by 
+# distance alone sends anything running from the player into the nearest
+# corner, so (as in Brogue's safety maps) the distances are flipped and scaled
+# up by FLEE_FACTOR, then smoothed so no square is more than a step's worth
+# worse than its best neighbour. A square next to a way out past the threat 
+# then looks better than a dead end the same distance away. Fleeing monsters
+# follow it downhill, same as with a distance field. Values are in tenths
+# of a step.
+class SafetyMap(DistanceField):
+    def __init__(self, level, field):
+        self.row = field.row
+        self.col = field.col
+        self.width = field.width
+        self.length = field.length
+        self.distances = array('i', [UNSAFE]) * (self.width * self.length)
+        self.__smooth(field)
+
+    def __smooth(self, field):
+        _width = self.width
+        _distances = self.distances
+        _queue = []
+        for _i, _d in enumerate(field.distances):
+            if _d != UNREACHABLE:
+                _distances[_i] = -int(_d * FLEE_FACTOR * 10)
+                _queue.append((_distances[_i], _i))
+        _queue.sort()
+
+        while _queue:
+            _v, _i = heappop(_queue)
+            if _v != _distances[_i]:
+                continue
+            _r, _c = divmod(_i, _width)
+            for _dr, _dc in NEIGHBOURS:
+                _nr = _r + _dr
+                _nc = _c + _dc
+                if _nr < 0 or _nr >= self.length or _nc < 0 or _nc >= _width:
+                    continue
+                _j = _nr * _width + _nc
+                if _distances[_j] != UNSAFE and _v + 10 < _distances[_j]:
+                    _distances[_j] = _v + 10
+                    heappush(_queue, (_v + 10, _j))
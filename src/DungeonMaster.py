@@ -18,7 +18,7 @@
 from copy import copy
 from copy import deepcopy
 from datetime import datetime
-from time import localtime, strftime, sleep
+from time import localtime, strftime
 from random import random
 from random import randrange
 from random import choice
@@ -28,9 +28,11 @@ from .Agent import BaseAgent
 from .Agent import BaseMonster
 from .Agent import IllegalMonsterMove
 from .Agent import STD_ENERGY_COST
+from .Animation import Animation
 from .Robots import BasicBot
 from .Robots import Roomba
 from .BaseTile import BaseTile
+from .Blast import Blast
 from .CharacterGenerator import CharacterGenerator
 from .CombatResolver import ShootingResolver
 from .CombatResolver import ThrowingResolver
@@ -41,11 +43,11 @@ from .Cyberspace import CyberspaceLevel
 from .Cyberspace import TrapSetOff
 from .PriorityQueue import PriorityQueue
 from .FieldOfView import get_lit_list
-from .FieldOfView import Shadowcaster
 from .FinalComplex import FinalComplexLevel
 from .GameLevel import GameLevel
 from .GameLevel import Noise
 from .GamePersistence import clean_up_files
+from .GamePersistence import get_level_dimensions
 from .GamePersistence import get_level_from_save_obj
 from .GamePersistence import get_preferences
 from .GamePersistence import get_save_file_name
@@ -160,6 +162,7 @@ class DungeonMaster:
         self.turn = 0
         self.virtual_turn = 0 # Time is kept seperately in cyberspace
         self.suspended_player = []
+        self.animation = None
 
     def get_meatspace_dmg_msg(self, delta, curr_hp):
         _p = float(delta) / float(curr_hp)
@@ -190,11 +193,14 @@ class DungeonMaster:
         robot.light_radius = robot.vision_radius
         _lvl = self.dungeon_levels[robot.curr_level]
         self.dui.set_command_context(RemoteRobotCC(self, self.dui))
-        self.add_player_to_level(robot.curr_level, robot)
         for m in _lvl.monsters:
             if isinstance(m, BasicBot) and m.serial_number == robot.serial_number:
                 break
+        _lvl.wake_monster(m)
         _lvl.monsters.remove(m)
+        _lvl.scheduler.remove(m)
+        _lvl.catch_up()
+        self.add_player_to_level(robot.curr_level, robot)
 
         self.dui.switch_to_remote_display()
         self.dui.write_sidebar()
@@ -207,6 +213,7 @@ class DungeonMaster:
         if not robot_destroyed:
             _lvl = self.dungeon_levels[self.player.curr_level]
             _lvl.monsters.append(self.player)
+            _lvl.scheduler.add(self.player)
 
         self.leaving_level_cleanup()
 
@@ -243,6 +250,7 @@ class DungeonMaster:
             self.player.damaged(self, _dmg, '', ['brain damage'])
             self.dui.display_message(self.get_meatspace_dmg_msg(_dmg, self.player.curr_hp), True)
 
+        _meat_level.catch_up()
         self.add_player_to_level(self.player.curr_level, self.player)
 
     # At this point the active level is still the meatspace level; level passed
@@ -296,14 +304,13 @@ class DungeonMaster:
     # the remote session, they could still see the light squares from the robot.
     def leaving_level_cleanup(self):
         lvl = self.dungeon_levels[self.player.curr_level]
-        for loc in self.player.sight_matrix:    
-            lvl.dungeon_loc[loc[0]][loc[1]].lit = False
+        lvl.clear_lit(self.player.sight_matrix)
 
     def add_player_to_level(self, level_num, player, suppress_msg=False):
         self.player.sight_matrix = {}
 
         # Check to see if there is a monster standing on the stairs when the player
-        # arrives.
+        # arrives. (Possibly one that wandered there while he was away)
         _lvl = self.dungeon_levels[level_num]
         _occ = _lvl.dungeon_loc[player.row][player.col].occupant
         if _occ not in ('', player):
@@ -408,7 +415,11 @@ class DungeonMaster:
             self.generate_next_level(curr_level, next_level_num)
             self.player.row, self.player.col = self.dungeon_levels[next_level_num].get_entrance()                
         else:
-            # Moving to an existing level
+            # Moving to an existing level. It's brought up to date before 
+            # anyone arrives, so whatever followed the player doesn't get 
+            # caught up in it, and new arrivals can't land where the player
+            # is headed.
+            self.dungeon_levels[next_level_num].catch_up()
             if curr_level.level_num > next_level_num:            
                 _sqr = self.dungeon_levels[next_level_num].get_exit()                
             else:
@@ -535,7 +546,8 @@ class DungeonMaster:
         _lvls = stuff[3]
         for _lvl_num in _lvls.keys():
             _lvl = _lvls[_lvl_num]
-            self.dungeon_levels[_lvl_num] = GetGameFactoryObject(self, _lvl[5], len(_lvl[0]), len(_lvl[0][0]), _lvl[4])
+            _length, _width = get_level_dimensions(_lvl)
+            self.dungeon_levels[_lvl_num] = GetGameFactoryObject(self, _lvl[5], _length, _width, _lvl[4])
             get_level_from_save_obj(self.dungeon_levels[_lvl_num], _lvl)
         
         self.player.dm = self
@@ -582,7 +594,7 @@ class DungeonMaster:
     def is_open(self, r, c, l_num):
         _level = self.dungeon_levels[l_num]        
         if _level.in_bounds(r,c):
-            return not _level.map[r][c].is_opaque()
+            return _level.opaque[r * _level.layer_width + c] == 0
 
         return False
 
@@ -799,6 +811,7 @@ class DungeonMaster:
         
                 if randio > 15:
                     tile.smash()
+                    _level.terrain_changed(door_r, door_c)
                     self.update_sqr(_level, door_r,door_c)
                     self.refresh_player_view()
                     self.dui.display_message('You smash open the door')
@@ -855,6 +868,7 @@ class DungeonMaster:
             self.player.energy -= STD_ENERGY_COST # player uses a turn because he has to try the door to see if it is locked
         else:
             tile.opened = True
+            _level.terrain_changed(r, c)
             self.dui.display_message('You open the door')
             self.player.energy -= STD_ENERGY_COST
             
@@ -945,7 +959,7 @@ class DungeonMaster:
                     level.douse_squares(i)
             elif isinstance(i, Items.LitFlare):
                 _msg = agent.get_name() + ' picks up the lit flare, which goes out.'
-                va = VisualAlert(agent.row, agent.col, _msg, '', level)
+                va = VisualAlert(agent.row, agent.col, _msg, '')
                 va.show_alert(self, False)
                 level.douse_squares(i)
                 return
@@ -1123,42 +1137,44 @@ class DungeonMaster:
         bullet_row = start_r
         bullet_col = start_c
 
-        while True:
-            prev_r = bullet_row
-            prev_c = bullet_col
-            bullet_row += dt[0]
-            bullet_col += dt[1]
+        _recording = self.__start_animation()
+        try:
+            while True:
+                prev_r = bullet_row
+                prev_c = bullet_col
+                bullet_row += dt[0]
+                bullet_col += dt[1]
 
-            _level.dungeon_loc[prev_r][prev_c].temp_tile = ''
+                _level.dungeon_loc[prev_r][prev_c].temp_tile = ''
 
-            if self.is_open(bullet_row, bullet_col, shooter.curr_level) and _level.dungeon_loc[bullet_row][bullet_col].occupant == '':
-                _level.dungeon_loc[bullet_row][bullet_col].temp_tile = bullet
-            else:
-                # If the square isn't open, item must have hit a monster or a solid
-                # terrain feature.
-                if _level.dungeon_loc[bullet_row][bullet_col].occupant != '':
-                    target = _level.dungeon_loc[bullet_row][bullet_col].occupant
-                    self.update_sqr(_level, prev_r,prev_c)
-                    if _sr.attack(shooter, target, gun):
+                if self.is_open(bullet_row, bullet_col, shooter.curr_level) and _level.dungeon_loc[bullet_row][bullet_col].occupant == '':
+                    _level.dungeon_loc[bullet_row][bullet_col].temp_tile = bullet
+                else:
+                    # If the square isn't open, item must have hit a monster or a solid
+                    # terrain feature.
+                    if _level.dungeon_loc[bullet_row][bullet_col].occupant != '':
+                        target = _level.dungeon_loc[bullet_row][bullet_col].occupant
+                        self.update_sqr(_level, prev_r,prev_c)
+                        if _sr.attack(shooter, target, gun):
+                            break
+                        else:
+                            _level.dungeon_loc[bullet_row][bullet_col].temp_tile = bullet
+                    elif isinstance(_level.map[bullet_row][bullet_col], T.Door):
+                        door = _level.map[bullet_row][bullet_col]
+                        door.handle_damage(self, _level, bullet_row, bullet_col, gun.shooting_dmg_roll())
                         break
                     else:
-                        _level.dungeon_loc[bullet_row][bullet_col].temp_tile = bullet
-                elif isinstance(_level.map[bullet_row][bullet_col], T.Door):
-                    door = _level.map[bullet_row][bullet_col]
-                    door.handle_damage(self, _level, bullet_row, bullet_col, gun.shooting_dmg_roll())
-                    break
-                else:
-                    self.update_sqr(_level, bullet_row,bullet_col)
-                    self.update_sqr(_level, prev_r,prev_c)
-                    break
+                        self.update_sqr(_level, bullet_row,bullet_col)
+                        self.update_sqr(_level, prev_r,prev_c)
+                        break
 
-            self.update_sqr(_level, bullet_row, bullet_col)
-            self.update_sqr(_level, prev_r,prev_c)
-            
-            if (bullet_row,bullet_col) in self.player.sight_matrix:
-                sleep(ANIMATION_PAUSE) 
+                self.update_sqr(_level, bullet_row, bullet_col)
+                self.update_sqr(_level, prev_r,prev_c)
+                self.animation.end_frame(ANIMATION_PAUSE)
 
-        _level.dungeon_loc[bullet_row][bullet_col].temp_tile =  '' 
+            _level.dungeon_loc[bullet_row][bullet_col].temp_tile =  '' 
+        finally:
+            self.__end_animation(_recording)
         
     def throw_item_down(self, item):
         _p = self.player
@@ -1192,48 +1208,52 @@ class DungeonMaster:
         item_row = start_r
         item_col = start_c
 
-        while _range > 0:
-            prev_r = item_row
-            prev_c = item_col
-            item_row += dt[0]
-            item_col += dt[1]
+        _recording = self.__start_animation()
+        try:
+            while _range > 0:
+                prev_r = item_row
+                prev_c = item_col
+                item_row += dt[0]
+                item_col += dt[1]
             
-            _lvl = self.dungeon_levels[self.player.curr_level]
-            _lvl.dungeon_loc[prev_r][prev_c].temp_tile = ''
+                _lvl = self.dungeon_levels[self.player.curr_level]
+                _lvl.dungeon_loc[prev_r][prev_c].temp_tile = ''
         
-            if self.is_open(item_row, item_col, _lvl.level_num) and _lvl.dungeon_loc[item_row][item_col].occupant == '':
-                _lvl.dungeon_loc[item_row][item_col].temp_tile = item
-                _range -= 1
-            else:
-                # If the square isn't open, item must have hit a monster or a solid
-                # terrain feature.
-                if _lvl.dungeon_loc[item_row][item_col].occupant != '':
-                    self.update_sqr(_lvl, prev_r, prev_c)
-                    _monster = _lvl.dungeon_loc[item_row][item_col].occupant
+                if self.is_open(item_row, item_col, _lvl.level_num) and _lvl.dungeon_loc[item_row][item_col].occupant == '':
+                    _lvl.dungeon_loc[item_row][item_col].temp_tile = item
+                    _range -= 1
+                else:
+                    # If the square isn't open, item must have hit a monster or a solid
+                    # terrain feature.
+                    if _lvl.dungeon_loc[item_row][item_col].occupant != '':
+                        self.update_sqr(_lvl, prev_r, prev_c)
+                        _monster = _lvl.dungeon_loc[item_row][item_col].occupant
                     
-                    if _monster.chance_to_catch(item):
-                        return
+                        if _monster.chance_to_catch(item):
+                            return
                         
-                    if _tr.attack(self.player, _monster, item):
+                        if _tr.attack(self.player, _monster, item):
+                            _lvl.dungeon_loc[item_row][item_col].temp_tile = ''
+                            self.update_sqr(_lvl, item_row, item_col)
+                            break
+                        else:
+                            # It missed, so it keeps on flying
+                            _lvl.dungeon_loc[item_row][item_col].temp_tile = item
+                            _range -= 1
+                    else:
+                        # we hit a non-open terrain, so move back one        
                         _lvl.dungeon_loc[item_row][item_col].temp_tile = ''
-                        self.update_sqr(_lvl, item_row, item_col)
+                        _lvl.dungeon_loc[prev_r][prev_c].temp_tile = ''
+                        item_row = prev_r
+                        item_col = prev_c                                      
                         break
-                    else:
-                        # It missed, so it keeps on flying
-                        _lvl.dungeon_loc[item_row][item_col].temp_tile = item
-                        _range -= 1
-                else:
-                    # we hit a non-open terrain, so move back one        
-                    _lvl.dungeon_loc[item_row][item_col].temp_tile = ''
-                    _lvl.dungeon_loc[prev_r][prev_c].temp_tile = ''
-                    item_row = prev_r
-                    item_col = prev_c                                      
-                    break
 
-            self.update_sqr(_lvl, item_row, item_col)
-            self.update_sqr(_lvl, prev_r,prev_c)
+                self.update_sqr(_lvl, item_row, item_col)
+                self.update_sqr(_lvl, prev_r,prev_c)
 
-            sleep(ANIMATION_PAUSE) # do I really want to bother doing this?
+                self.animation.end_frame(ANIMATION_PAUSE)
+        finally:
+            self.__end_animation(_recording)
 
         _glasses = self.player.inventory.get_armour_in_location('glasses')
         if isinstance(_glasses, Items.TargetingWizard) and _glasses.charge > 0:
@@ -1474,6 +1494,7 @@ class DungeonMaster:
                     self.dui.display_message("You make a lot of sparks but not much else happens.")
                 elif _sqr.get_type() == T.DOOR and not _sqr.is_open():
                     _sqr.smash()
+                    _lvl.terrain_changed(_row, _col)
                     self.update_sqr(_lvl, _row, _col)
                     self.refresh_player_view()
                     self.dui.display_message("You make short work of that door.")
@@ -1589,11 +1610,10 @@ class DungeonMaster:
             return loc.temp_tile
         elif visible and self.is_occupant_visible_to_agent(agent, loc.occupant, omniscient):
             return loc.occupant
-        elif not _level.map[r][c].is_recepticle() and _level.size_of_item_stack(r, c) > 0:
-            i = loc.item_stack[-1]  
-            return loc.item_stack[-1]   
-        else:
-            return _level.map[r][c]
+
+        _sqr = _level.map[r][c]
+        _item = None if _sqr.is_recepticle() else _level.top_item(r, c)
+        return _item if _item is not None else _sqr
             
     def get_tile_help_info(self,row, col, l_num):
         _level = self.dungeon_levels[l_num]
@@ -1685,7 +1705,35 @@ class DungeonMaster:
             
     def update_sqr(self, level, r , c):
         if self.can_player_see_location(r, c, level.level_num):
-            self.dui.update_view(self.get_sqr_info_for_agent(r, c, self.player, False))
+            _sqr = self.get_sqr_info_for_agent(r, c, self.player, False)
+            if self.animation is not None:
+                self.animation.record(level.level_num, _sqr)
+            else:
+                self.dui.update_view(_sqr)
+
+    # Bullets, thrown items and explosions are recorded as the game works out
+    # what they hit, and the UI plays the frames before the next message or
+    # once the animation is over, so the game isn't kept waiting on the 
+    # screen for every step. Returns whether this started a new recording: a
+    # shot that sets off an explosion just gets the explosion's frames added 
+    # on to its own.
+    def __start_animation(self):
+        if self.animation is not None:
+            return False
+        self.animation = Animation(self.dui, self.prefs["show animations"])
+        return True
+
+    def __end_animation(self, started):
+        if not started:
+            return
+        _animation = self.animation
+        self.animation = None
+        _animation.end_frame(ANIMATION_PAUSE)
+        self.dui.play_animation()
+
+        # Then put back whatever's really there now
+        for _level_num, _r, _c in _animation.touched:
+            self.update_sqr(self.dungeon_levels[_level_num], _r, _c)
 
     def passive_search(self, loc):
         if self.player.has_condition('dazed'): 
@@ -1722,23 +1770,19 @@ class DungeonMaster:
             _perception_roll = 0
         
         _vr = self.player.calc_curr_vision_radius()
-        sc = Shadowcaster(self, _vr, _pr, _pc, self.player.curr_level)
-        _visible = sc.calc_visible_list()
+        _visible = _level.calc_visible_list(_vr, _pr, _pc)
         
         _sqrs = [(_pr,_pc)]
         for _sqr in get_lit_list(self.player.light_radius):
             _s = (_pr + _sqr[0], _pc + _sqr[1])
             if _s in _visible: _sqrs.append(_s)
         
-        for _ls in _level.light_sources:
-            for _sqr in _ls.illuminates:
-                if _sqr in _visible: _sqrs.append(_sqr)
+        for _sqr in _visible:
+            if _level.is_lit(_sqr[0], _sqr[1]): _sqrs.append(_sqr)
         
         for _s in _sqrs:
             self.player.sight_matrix[_s] = 0
-            _level.dungeon_loc[_s[0]][_s[1]].visible = True
-            _level.dungeon_loc[_s[0]][_s[1]].visited = True
-            _level.dungeon_loc[_s[0]][_s[1]].lit = True
+            _level.mark_in_sight(_s[0], _s[1])
             
             _loc = self.get_sqr_info_for_agent(_s[0],_s[1], self.player, False)
             if _perception_roll > 14:
@@ -1757,9 +1801,7 @@ class DungeonMaster:
         
     # Called when a square moves out of sight range
     def __loc_out_of_sight(self, loc, level):
-        level.dungeon_loc[loc[0]][loc[1]].visible = False
-        level.dungeon_loc[loc[0]][loc[1]].visited = True
-        level.dungeon_loc[loc[0]][loc[1]].lit = False
+        level.mark_out_of_sight(loc[0], loc[1])
                         
     def cmd_pass(self):
         self.refresh_player_view() # This allows a passive search
@@ -1892,7 +1934,7 @@ class DungeonMaster:
             if level.map[r][c].get_type() in [T.OCEAN, T.WATER]:
                 msg = 'Splash!  The ' + item.get_full_name() + ' sinks into the water.'
                 alt = 'You hear a distance sploosh.'
-                alert = VisualAlert(r, c, msg, alt, level)
+                alert = VisualAlert(r, c, msg, alt)
                 alert.show_alert(self, False)
                 self.update_sqr(level, r, c)
             else:
@@ -1958,7 +2000,7 @@ class DungeonMaster:
             _stack = _loc.item_stack
             for _item in _stack:
                 self.item_hits_ground(_level_of_hole, _hole[0], _hole[1], _item)
-            _loc.item_stack = []
+            _level_of_hole.clear_item_stack(_hole[0], _hole[1])
             #self.update_sqr(_level_of_hole, _hole[0], _hole[1])
 
         self.refresh_player_view()
@@ -1975,40 +2017,35 @@ class DungeonMaster:
 
         bullet = Items.Bullet('*', 'white')
 
-        # As a hack, I'm using the shadowcaster to calculate the area of effect.  Explosions
-        # should fill a volume, of course, maybe I'll change that in some future version
-        # This will also have a flaw if I ever add a 'see-through' wall (like a force-field)
-        # Also, perhaps dmg should go down further from blast radius??
-        sc = Shadowcaster(self, explosive.blast_radius, row, col, level.level_num)
-        areaOfEffect = sc.calc_visible_list()
-        areaOfEffect[(row, col)] = 0
-
-        for key in list(areaOfEffect.keys()):
-            d_loc = level.dungeon_loc[key[0]][key[1]]
-            m_sqr = level.map[key[0]][key[1]]
-            m_sqr.handle_damage(self, level, key[0], key[1], dmg)
-
-            # If a bomb was placed on a Terminal, the bomb replaces the Terminal
-            # on the map so we also need to check the previous_tile field, where
-            # it will have been stashed.
-            if (hasattr(m_sqr, 'previous_tile')):
-                m_sqr.previous_tile.handle_damage(self, level, key[0], key[1], dmg)
-
-            if m_sqr.is_open():
-                sleep(ANIMATION_PAUSE/10) 
-                level.dungeon_loc[key[0]][key[1]].temp_tile = bullet
-                self.update_sqr(level, key[0], key[1])
-                        
-            if d_loc.occupant != '':
+        # The blast (and the damage it does) goes down the further it gets 
+        # from where the bomb went off. Terrain damage is done first, since 
+        # the tiles were collected before anything got blown up.
+        _blast = Blast(level, row, col, explosive.blast_radius, dmg)
+        for _tile, _r, _c, _dmg in _blast.terrain:
+            _tile.handle_damage(self, level, _r, _c, _dmg)
+
+        # Draw the blast a ring at a time rather than a square at a time
+        _recording = self.__start_animation()
+        try:
+            for _ring in _blast.rings:
+                for _r, _c in _ring:
+                    if level.map[_r][_c].is_open():
+                        level.dungeon_loc[_r][_c].temp_tile = bullet
+                        self.update_sqr(level, _r, _c)
+                self.animation.end_frame(ANIMATION_PAUSE/10)
+
+            for _victim, _dmg in _blast.occupants:
                 try:
-                    self.explosive_effect(level, d_loc.occupant, dmg, explosive)
+                    self.explosive_effect(level, _victim, _dmg, explosive)
                 except TurnInterrupted:
                     # A monster was killed by the explosion, but we can ignore the exception
                     pass
 
-        for key in list(areaOfEffect.keys()):
-            level.dungeon_loc[key[0]][key[1]].temp_tile = ''
-            self.update_sqr(level, key[0], key[1])
+            for _r, _c in _blast.cells:
+                level.dungeon_loc[_r][_c].temp_tile = ''
+                self.update_sqr(level, _r, _c)
+        finally:
+            self.__end_animation(_recording)
         
         if explosive.get_name(1) != 'flash bomb':   
             level.begin_security_lockdown()
@@ -2092,7 +2129,7 @@ class DungeonMaster:
             return True
         _pts = bresenham_line(start_r, start_c, target_r, target_c)
         for _pt in _pts:
-            if not level.map[_pt[0]][_pt[1]].is_passable():
+            if not level.passable[_pt[0] * level.layer_width + _pt[1]]:
                 return False
         return True
         
@@ -2291,9 +2328,20 @@ class DungeonMaster:
             if self.suspended_player[0].curr_level != self.player.curr_level:
                 _active_lvls.append(self.dungeon_levels[self.suspended_player[0].curr_level])
 
-        _monsters_who_acted = []
+        _targets = [self.get_true_player()]
+        if self.player is not _targets[0]:
+            _targets.append(self.player)
+
+        # Only the monsters with enough energy to act (or who are stunned and 
+        # need to try to shake it off) come out of the level's scheduler. It
+        # also hands back their energy for the turn once the turn is over.
+        # Sleeping monsters aren't in it at all until something wakes them.
         for _lvl in _active_lvls:
-            for _m in _lvl.monsters:
+            _sched = _lvl.scheduler
+            _lvl.wake_dormant_monsters(_targets)
+            _lvl.precompute_monster_vision(_targets, _sched.begin_tick())
+            _m = _sched.next_turn()
+            while _m is not None:
                 self.active_agent = _m
                 try:
                     if self.active_agent.has_condition('stunned'):
@@ -2310,16 +2358,14 @@ class DungeonMaster:
                         self.dui.update_status_bar()
                 except TurnInterrupted:
                     pass
-                _monsters_who_acted.append(_m)
                 self.active_agent = ''
+                _m = _sched.next_turn()
             
             _lvl.end_of_turn()
+            _sched.end_tick()
 
-        # restore energy to players and monsters
-        # this will change to be a method that also calcs speed modifiers
+        # restore energy to the player
         self.player.energy += self.player.base_energy + self.player.sum_effect_bonuses('speed')
-        for _m in _monsters_who_acted:
-            _m.energy += _m.base_energy + _m.sum_effect_bonuses('speed')
         
     def debug_add_item(self, words):
         _request = ""
@@ -2400,6 +2446,10 @@ class DungeonMaster:
                     m = _level.monsters[0]
                     _level.remove_monster(m, m.row, m.col)
                 self.dui.draw_screen()
+            elif _words[0] == 'paths':
+                _pc = _level.path_cache
+                self.dui.display_message('Paths: %d hits, %d repaired, %d searched for (%d squares expanded)' 
+                    % (_pc.hits, _pc.repairs, _pc.misses, _pc.searched))
 
         except UnknownDebugCommand:
             self.dui.clear_msg_line()
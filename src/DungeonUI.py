@@ -22,7 +22,6 @@ from string import digits
 from string import ascii_letters
 
 from .BaseTile import BaseTile
-from .DisplayGuts import DisplayGuts
 from .GamePersistence import get_preferences
 from .GamePersistence import read_scores
 from .GamePersistence import save_preferences
@@ -67,11 +66,19 @@ class MessageMemory(object):
         _messages.reverse()
         return _messages
         
+# Everything actually drawn or read from the keyboard goes through guts. By
+# default that's an SDL window (DisplayGuts) but a headless game can hand in
+# something else, such as a HeadlessGuts.
 class DungeonUI(object):
-    def __init__(self, version, keymap):
+    def __init__(self, version, keymap, guts=None):
         self.__message_memory = MessageMemory(MESS_HIST_SIZE)
         self.keymap = keymap
-        self.guts = DisplayGuts(24, 80, 18, 'crashRun ' + version, self)
+        if guts is None:
+            # Imported here so that headless games don't need SDL installed
+            from .DisplayGuts import DisplayGuts
+            guts = DisplayGuts(24, 80, 18, 'crashRun ' + version, self)
+        self.guts = guts
+        self.__animation_frames = []
         
     # Expects menu to be in the form of:
     #   [(key0,q0,response0),(key1,q1,response1),...]
@@ -189,6 +196,7 @@ class DungeonUI(object):
         else:
             message = msg
         self.__message_memory.append(message)
+        self.play_animation()
         self.guts.write_message(message + ' ', pause_for_more)
     
     def do_player_action(self):
@@ -488,6 +496,7 @@ class DungeonUI(object):
                 return 'home'
                    
     def write_screen(self, raw_lines, pause_at_end, allow_esc = False):
+        self.play_animation()
         self.guts.write_screen(raw_lines, pause_at_end, allow_esc)
 
     def __stat_info(self, player, stat):
@@ -650,6 +659,18 @@ class DungeonUI(object):
         self.wait_for_input()
         self.guts.redraw_screen()
 
+    # Frames of an animation (a bullet in flight, etc.) wait here until 
+    # they're played, which happens before the next message or screen of 
+    # text so things are still shown in the order they happened
+    def queue_animation_frame(self, sqrs, pause):
+        self.__animation_frames.append((sqrs, pause))
+
+    def play_animation(self):
+        if len(self.__animation_frames) > 0:
+            _frames = self.__animation_frames
+            self.__animation_frames = []
+            self.guts.play_animation(_frames)
+
     def show_vision(self, vision):
         self.guts.show_vision(vision)
 
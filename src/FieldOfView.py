@@ -18,6 +18,8 @@
 # This is an implementation of a shadowcasting line-of-sight algorithm described by
 # Bjorn Bergstrom at www.roguelikedevelopment.org. 
 
+from collections import OrderedDict
+
 lit_matrix = {}
 lit_matrix[1] = [(-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1)]
 lit_matrix[2] = [(-2,-1), (-2,0), (-2,1),
@@ -76,394 +78,339 @@ def get_lit_list(radius):
         lit_matrix[radius] = calc_lit_list(radius)
     return lit_matrix[radius]
         
+# The shadowcaster only really knows how to scan one octant. Depth d runs
+# outward from the viewer and t runs across each row of the octant from -d
+# (the diagonal) up to 0 (the axis). Slopes are t/d, kept as integer
+# (numerator, denominator) pairs so there's no floating point in the scan.
+#
+# Each of the eight real octants is an entry in this table saying how a step
+# in d and a step in t move us around the map, plus how that octant nudges a
+# slope that needs tilting (see __tilted_bound()):
+#
+#   (rows per d, rows per t, cols per d, cols per t, tilt)
+#
+# The order matches the order the octants have always been scanned in, which
+# keeps the visible list coming back in the same order as before.
+ROW_TILT = 0
+
+OCTANTS = ((-1, 0, 0, 1, ROW_TILT),
+            (-1, 0, 0, -1, ROW_TILT),
+            (0, 1, 1, 0, -1),
+            (0, -1, 1, 0, 1),
+            (1, 0, 0, -1, ROW_TILT),
+            (1, 0, 0, 1, ROW_TILT),
+            (0, -1, -1, 0, 1),
+            (0, 1, -1, 0, 1))
+
+# Monster vision uses the symmetric scan (see __symmetric_cast()) so that a
+# monster can see something exactly when it could see the monster. The 
+# player's own view keeps the original scan.
+SYMMETRIC_VISION = True
+            
 class Shadowcaster(object):
-    __slope_tilt = 0.2 # used when we have to manually adjust a slope
-
-    def __init__(self, dm, max_radius, p_row, p_col, level_num):
+    def __init__(self, dm, max_radius, p_row, p_col, level_num, symmetric=False):
+        _level = dm.dungeon_levels[level_num]
+        self.symmetric = symmetric
         self.__p_row = p_row
         self.__p_col = p_col
-        self.__dm = dm
-        self.__max_radius = max_radius
+        self.__opaque = _level.opaque
+        self.__length = _level.layer_length
+        self.__width = _level.layer_width
         self.__max_radius_sqred = max_radius * max_radius
+        self.__max_depth = max_radius
         self.__visible = {}
         self.level_num = level_num
 
     # When light radius is 1, we can probably just calculate it manually.
     def calc_visible_list(self):
-        self.__shadowcast_o1(-1.0,0.0,1.0)
-        self.__shadowcast_o2(1.0,0.0,1.0)
-        self.__shadowcast_o3(1.0,0.0,1.0)
-        self.__shadowcast_o4(-1.0,0.0,1.0)
-        self.__shadowcast_o5(-1.0,0.0,-1.0)
-        self.__shadowcast_o6(1.0,0.0,-1.0)
-        self.__shadowcast_o7(1.0,0.0,-1.0)
-        self.__shadowcast_o8(-1.0,0.0,-1.0)
+        for _octant in OCTANTS:
+            self.__cast(_octant)
         
         return self.__visible
-                    
-    def __y_to_r(self,y):
-        return int(round(self.__p_row - y))
-
-    def __r_to_y(self,r):
-        return float(self.__p_row) - float(r)
-
-    def __x_to_c(self,x):
-        return int(round(self.__p_col + x))
-
-    def __c_to_x(self,c):
-        return float(c)  - float(self.__p_col)
-
-    # Note that all the calculations where an x or a y or slope
-    # are determined are based off of the origin (0,0)
-    # so we can simplify the functions
-    def __calc_x(self,y,slope):
-        if slope == 0.0:
-            return 0.0 # Maybe change to an exception??
-        else:
-            return y / slope
-
-    def __calc_y(self,x,slope):
-        return slope * x
 
-    def __slope(self,x,y):
-        if x == 0.0:
-            return 0.0
+    def __cast(self, octant):
+        if self.symmetric:
+            self.__symmetric_cast(octant, 1, -1, 1, 0, 1)
         else:
-            return y / x
-    
-    # There are eight shadow cast functions (one for each octant in the circle)
-    # which are all very similar, so I document one well and the comments will
-    # apply to all of them
-    def __shadowcast_o1(self,sslope,eslope,y):
-        while y <= self.__max_radius:
-            start_x = self.__calc_x(y,sslope)
-            end_x = self.__calc_x(y,eslope)
-            start_c = self.__x_to_c(start_x)
-            end_c = self.__x_to_c(end_x)
-            curr_row = self.__y_to_r(y)
-            
-            pclear = self.__dm.is_open(curr_row, start_c, self.level_num)
-            while start_c <= end_c:
-                #Are we within the circle?
-                if y**2 + self.__c_to_x(start_c)**2 > self.__max_radius_sqred + 0.5:
-                    start_c += 1
-                    continue
-                
-                cclear = self.__dm.is_open(curr_row,start_c, self.level_num)
-
-                if cclear != pclear:
-                    if pclear:
-                        n_eslope = self.__slope(self.__c_to_x(start_c) - 0.5,y - 0.5)
-                        
-                        # If we generate a n_eslope that is equal to the sslope,
-                        # tilt it a bit to avoid overly narrowing player's POV
-                        # This happens in configurations like this:
-                        #
-                        #       .     .
-                        #        .   .
-                        #     .#.
-                        #         #@# 
-                        #         .#.
-                        #        .   .
-                        #       .     .
-                        #
-                        # The slope calculated for the recursive call is 1, which
-                        # leaves too narrow a beem.  Nudging the slope over a bit
-                        # in this case widens things out a little bit giving something 
-                        # like:
-                        #
-                        #      ..    ..
-                        #       ..   .
-                        #     .#.
-                        #         #@# 
-                        #        ..#..
-                        #       ..   ..
-                        #       .     .
-                        #
-                        # (Actually at a light radius of three, the beem is still
-                        # a single line of pixels)
-                        if n_eslope == sslope:
-                            n_eslope -= self.__slope_tilt
-
-                        self.__shadowcast_o1(sslope,n_eslope,y + 1.0)
-                    else:
-                        sslope = self.__slope(self.__c_to_x(start_c) - 0.5,y + 0.5)
-
-                self.__visible[curr_row,start_c] = 0
-
-                pclear = cclear
-                start_c += 1
-
-            if not self.__dm.is_open(curr_row, end_c, self.level_num):
-                break
-
-            y += 1.0
-
-    def __shadowcast_o2(self,sslope,eslope,y):
-        while y <= self.__max_radius:
-            start_x = self.__calc_x(y,sslope)
-            end_x = self.__calc_x(y,eslope)
-            start_c = self.__x_to_c(start_x)
-            end_c = self.__x_to_c(end_x)
-            curr_row = self.__y_to_r(y)
-
-            pclear = self.__dm.is_open(curr_row, start_c, self.level_num)    
-            while start_c >= end_c:
-                # Are we within the circle?
-                if y**2 + self.__c_to_x(start_c)**2 > self.__max_radius_sqred + 0.5:
-                    start_c -= 1
-                    continue
-
-                cclear = self.__dm.is_open(curr_row, start_c, self.level_num)
-
-                if cclear != pclear:
-                    if pclear:
-                        n_eslope = self.__slope(self.__c_to_x(start_c) + 0.5,y - 0.5)
-
-                        # If we generate a n_eslope that is equal to the sslope,
-                        # tilt it a bit to avoid overly narrowing player's POV
-                        if n_eslope == sslope:
-                            n_eslope += self.__slope_tilt
-                        self.__shadowcast_o2(sslope,n_eslope,y + 1.0)
-                    else:
-                        sslope = self.__slope(self.__c_to_x(start_c) + 0.5,y + 0.5)
-
-                self.__visible[curr_row,start_c] = 0
-
-                pclear = cclear
-                start_c -= 1
-
-            if not self.__dm.is_open(curr_row, end_c, self.level_num):
-                break
-
-            y += 1.0
-
-    def __shadowcast_o3(self,sslope,eslope,x):
-        while x <= self.__max_radius:
-            start_y = self.__calc_y(x,sslope)
-            end_y = self.__calc_y(x,eslope)
-            start_r = self.__y_to_r(start_y)
-            end_r = self.__y_to_r(end_y)
-            curr_col = self.__x_to_c(x)
-
-            pclear = self.__dm.is_open(start_r, curr_col, self.level_num)
-            while start_r <= end_r:
-                # Are we within the circle?
-                if self.__r_to_y(start_r)**2 + x**2 > self.__max_radius_sqred + 0.5:
-                    start_r += 1
-                    continue
-
-                cclear = self.__dm.is_open(start_r, curr_col, self.level_num)
-
-                if cclear != pclear:
-                    if pclear:
-                        n_eslope = self.__slope(x - 0.5,self.__r_to_y(start_r) + 0.5)
-                        # If we generate a n_eslope that is equal to the sslope,
-                        # tilt it a bit to avoid overly narrowing player's POV
-                        if n_eslope == sslope:
-                            n_eslope += self.__slope_tilt
-                        self.__shadowcast_o3(sslope,n_eslope,x + 1.0)
-                    else:
-                        sslope = self.__slope(x + 0.5,self.__r_to_y(start_r) + 0.5)
-                self.__visible[start_r,curr_col] = 0
-
-                pclear = cclear
-                start_r += 1
-        
-            if not self.__dm.is_open(end_r, curr_col, self.level_num):
-                break
-
-            x += 1.0
-
-    def __shadowcast_o4(self,sslope,eslope,x):
-        while x <= self.__max_radius:
-            start_y = self.__calc_y(x,sslope)
-            end_y = self.__calc_y(x,eslope)
-            start_r = self.__y_to_r(start_y)
-            end_r = self.__y_to_r(end_y)
-            curr_col = self.__x_to_c(x)
-
-            pclear = self.__dm.is_open(start_r, curr_col, self.level_num)
-
-            while start_r >= end_r:
+            self.__shadowcast(octant, 1, -1, 1, 0, 1, False)
+
+    # Would (row, col) be in calc_visible_list()? Rather than work out the
+    # whole field of view, only the octants the square can fall in are
+    # scanned, and only as far out as the square is, which gives exactly the 
+    # same answer. (The slope tilt in octants 4, 7 and 8 can carry their scans
+    # a little past the axis, so they're also checked for squares just beyond
+    # it.)
+    def is_visible(self, row, col):
+        _dr = row - self.__p_row
+        _dc = col - self.__p_col
+        if _dr * _dr + _dc * _dc > self.__max_radius_sqred:
+            return False
+
+        for _octant in OCTANTS:
+            _rd, _rt, _cd, _ct, _tilt = _octant
+            if _rt == 0:
+                d, t = _dr * _rd, _dc * _ct
+            else:
+                d, t = _dc * _cd, _dr * _rt
+            _past_axis = d // 5 + 1 if _tilt == 1 and not self.symmetric else 0
+            if d < 1 or t < -d or t > _past_axis:
+                continue
+
+            self.__max_depth = d
+            self.__cast(_octant)
+            if (row, col) in self.__visible:
+                return True
+
+        return False
+
+    def __is_open(self, r, c):
+        if r < 0 or r >= self.__length or c < 0 or c >= self.__width:
+            return False
+
+        return not self.__opaque[r * self.__width + c]
+
+    # Where the slope num/den crosses row d, rounded to the nearest square.
+    # (The slopes we generate never land exactly on a half)
+    def __round_slope(self, num, den, d):
+        return (2 * num * d + den) // (2 * den)
+
+    # If a recursive scan would start and end on the same slope, the end slope
+    # is tilted a bit to avoid overly narrowing the viewer's POV. This happens 
+    # in configurations like this:
+    #
+    #       .     .
+    #        .   .
+    #     .#.
+    #         #@# 
+    #         .#.
+    #        .   .
+    #       .     .
+    #
+    # The slope calculated for the recursive call is 1, which leaves too 
+    # narrow a beam.  Nudging the slope over a bit in this case widens things
+    # out a little bit giving something like:
+    #
+    #      ..    ..
+    #       ..   .
+    #     .#.
+    #         #@# 
+    #        ..#..
+    #       ..   ..
+    #       .     .
+    #
+    # (Actually at a light radius of three, the beam is still a single line 
+    # of pixels)
+    #
+    # The original octant routines nudged the slope by 0.2, which for the 
+    # octants that scan rows is applied to d/t rather than t/d, and octant 3 
+    # nudges the opposite way to the others. That's preserved here so the 
+    # visible squares come out the same as they always have.
+    def __tilted_bound(self, octant, num, den, d):
+        _tilt = octant[4]
+        if _tilt != ROW_TILT:
+            return self.__round_slope(5 * num + _tilt * den, 5 * den, d)
+
+        _num = 5 * num
+        _den = 5 * den - num
+        if (2 * _num * d + _den) % (2 * _den) != 0:
+            return (2 * _num * d + _den) // (2 * _den)
+
+        # Landing exactly on a half, the old float arithmetic could round
+        # either way, so fall back to doing exactly what it did.
+        _w = d / (den / num - 0.2)
+        _tc = octant[3]
+        return _tc * (int(round(self.__p_col + _tc * _w)) - self.__p_col)
+
+    def __shadowcast(self, octant, d, s_num, s_den, e_num, e_den, tilted):
+        _rd, _rt, _cd, _ct, _tilt = octant
+        while d <= self.__max_depth:
+            t = self.__round_slope(s_num, s_den, d)
+            if tilted:
+                _end_t = self.__tilted_bound(octant, e_num, e_den, d)
+            else:
+                _end_t = self.__round_slope(e_num, e_den, d)
+            _row = self.__p_row + d * _rd
+            _col = self.__p_col + d * _cd
+            _d_sqred = d * d
+
+            pclear = self.__is_open(_row + t * _rt, _col + t * _ct)
+            while t <= _end_t:
                 # Are we within the circle?
-                if self.__r_to_y(start_r)**2 + x**2 > self.__max_radius_sqred + 0.5:
-                    start_r -= 1
+                if _d_sqred + t * t > self.__max_radius_sqred:
+                    t += 1
                     continue
 
-                cclear = self.__dm.is_open(start_r, curr_col, self.level_num)
-                
-                if cclear != pclear:
-                    if pclear:
-                        n_eslope = self.__slope(x - 0.5,self.__r_to_y(start_r) - 0.5)
-                        # If we generate a n_eslope that is equal to the sslope,
-                        # tilt it a bit to avoid overly narrowing player's POV
-                        if n_eslope == sslope:
-                            n_eslope += self.__slope_tilt
-                        self.__shadowcast_o4(sslope,n_eslope,x + 1.0)
-                    else:
-                        sslope = self.__slope(x + 0.5,self.__r_to_y(start_r) - 0.5)
-
-                self.__visible[start_r,curr_col] = 0
-                
-                pclear = cclear
-                start_r -= 1
-        
-            if not self.__dm.is_open(end_r, curr_col, self.level_num):
-                break
-
-            x += 1.0
-
-    def __shadowcast_o5(self,sslope,eslope,y):
-        while y >= -self.__max_radius:
-            start_x = self.__calc_x(y,sslope)
-            end_x = self.__calc_x(y,eslope)
-            start_c = self.__x_to_c(start_x)
-            end_c = self.__x_to_c(end_x)
-            curr_row = self.__y_to_r(y)
-            
-            pclear = self.__dm.is_open(curr_row, start_c, self.level_num)
-            while start_c  >= end_c:
-                # Are we within the circle?
-                if y**2 + self.__c_to_x(start_c)**2 > self.__max_radius_sqred + 0.5:
-                    start_c -= 1
-                    continue
-
-                cclear = self.__dm.is_open(curr_row, start_c, self.level_num)
+                _r = _row + t * _rt
+                _c = _col + t * _ct
+                cclear = self.__is_open(_r, _c)
 
                 if cclear != pclear:
                     if pclear:
-                        n_eslope = self.__slope(self.__c_to_x(start_c) + 0.5,y + 0.5)
-                        # If we generate a n_eslope that is equal to the sslope,
-                        # tilt it a bit to avoid overly narrowing player's POV
-                        if n_eslope == sslope:
-                            n_eslope -= self.__slope_tilt
-                        self.__shadowcast_o5(sslope,n_eslope,y - 1.0)
+                        _n_num = 2 * t - 1
+                        _n_den = 2 * d - 1
+                        _tilted = _n_num * s_den == s_num * _n_den
+                        self.__shadowcast(octant, d + 1, s_num, s_den, _n_num, _n_den, _tilted)
                     else:
-                        sslope = self.__slope(self.__c_to_x(start_c) + 0.5,y - 0.5)
+                        s_num = 2 * t - 1
+                        s_den = 2 * d + 1
 
-                self.__visible[curr_row,start_c] = 0
+                self.__visible[_r, _c] = 0
 
                 pclear = cclear
-                start_c -= 1
+                t += 1
 
-            if not self.__dm.is_open(curr_row, end_c, self.level_num):
+            if not self.__is_open(_row + _end_t * _rt, _col + _end_t * _ct):
                 break
 
-            y -= 1.0
-
-    def __shadowcast_o6(self,sslope,eslope,y):
-        while y >= -self.__max_radius:
-            start_x = self.__calc_x(y,sslope)
-            end_x = self.__calc_x(y,eslope)
-            start_c = self.__x_to_c(start_x)
-            end_c = self.__x_to_c(end_x)
-            curr_row = self.__y_to_r(y)
-        
-            pclear = self.__dm.is_open(curr_row, start_c, self.level_num)
-            while start_c  <= end_c:
-                # Are we within the circle?
-                if y**2 + self.__c_to_x(start_c)**2 > self.__max_radius_sqred + 0.5:
-                    start_c += 1
-                    continue
-
-                cclear = self.__dm.is_open(curr_row, start_c, self.level_num)
-
-                if cclear != pclear:
-                    if pclear:
-                        n_eslope = self.__slope(self.__c_to_x(start_c) - 0.5,y + 0.5)
-                        # If we generate a n_eslope that is equal to the sslope,
-                        # tilt it a bit to avoid overly narrowing player's POV
-                        if n_eslope == sslope:
-                            n_eslope += self.__slope_tilt
-                        self.__shadowcast_o6(sslope,n_eslope,y - 1.0)
-                    else:
-                        sslope = self.__slope(self.__c_to_x(start_c)-0.5,y-0.5)
-
-                self.__visible[curr_row,start_c] = 0
+            d += 1
+
+    # The symmetric scan follows the rules from Albert Ford's symmetric 
+    # shadowcasting: a floor square is visible only if its centre lies inside
+    # the unobstructed beam, while a wall is visible if any of it is. Light 
+    # runs both ways under those rules, so A can see B exactly when B can see
+    # A. It doesn't have the slope tilting of the original scan, so its
+    # views are a little different at the edges of shadows.
+    def __symmetric_cast(self, octant, d, s_num, s_den, e_num, e_den):
+        _rd, _rt, _cd, _ct, _tilt = octant
+        while d <= self.__max_depth:
+            _row = self.__p_row + d * _rd
+            _col = self.__p_col + d * _cd
+            _d_sqred = d * d
+            _min_t = (2 * d * s_num + s_den) // (2 * s_den)
+            _max_t = -((e_den - 2 * d * e_num) // (2 * e_den))
+
+            pclear = None
+            for t in range(_min_t, _max_t + 1):
+                _r = _row + t * _rt
+                _c = _col + t * _ct
+                cclear = self.__is_open(_r, _c)
+
+                if _d_sqred + t * t <= self.__max_radius_sqred:
+                    if not cclear or (t * s_den >= d * s_num and t * e_den <= d * e_num):
+                        self.__visible[_r, _c] = 0
+
+                if pclear is False and cclear:
+                    s_num = 2 * t - 1
+                    s_den = 2 * d
+                elif pclear and not cclear:
+                    self.__symmetric_cast(octant, d + 1, s_num, s_den, 2 * t - 1, 2 * d)
 
                 pclear = cclear
-                start_c += 1
-
-            if not self.__dm.is_open(curr_row, end_c, self.level_num):
-                break
 
-            y -= 1.0
-
-    def __shadowcast_o7(self,sslope,eslope,x):
-        while x >= -self.__max_radius:
-            start_y = self.__calc_y(x,sslope)
-            end_y = self.__calc_y(x,eslope)
-            start_r = self.__y_to_r(start_y)
-            end_r = self.__y_to_r(end_y)
-            curr_col = self.__x_to_c(x)
-
-            pclear = self.__dm.is_open(start_r, curr_col, self.level_num)
-            while start_r >= end_r:
-                # Are we within the circle?
-                if self.__r_to_y(start_r)**2 + x**2 > self.__max_radius_sqred + 0.5:
-                    start_r -= 1
-                    continue
-
-                cclear = self.__dm.is_open(start_r, curr_col, self.level_num)
-
-                if cclear != pclear:
-                    if pclear:
-                        n_eslope = self.__slope(x + 0.5,self.__r_to_y(start_r) - 0.5)
-                        # If we generate a n_eslope that is equal to the sslope,
-                        # tilt it a bit to avoid overly narrowing player's POV
-                        if n_eslope == sslope:
-                            n_eslope -= self.__slope_tilt
-
-                        self.__shadowcast_o7(sslope,n_eslope,x - 1.0)
-                    else:
-                        sslope = self.__slope(x - 0.5,self.__r_to_y(start_r) - 0.5)
-    
-                self.__visible[start_r,curr_col] = 0
-
-                pclear = cclear
-                start_r -= 1
-        
-            if not self.__dm.is_open(end_r, curr_col, self.level_num):
-                break
-
-            x -= 1.0
-
-    def __shadowcast_o8(self,sslope,eslope,x):
-        while x >= -self.__max_radius:
-            start_y = self.__calc_y(x,sslope)
-            end_y = self.__calc_y(x,eslope)
-            start_r = self.__y_to_r(start_y)
-            end_r = self.__y_to_r(end_y)
-            curr_col = self.__x_to_c(x)
-
-            pclear = self.__dm.is_open(start_r, curr_col, self.level_num)
-            while start_r <= end_r:
-                # Are we within the circle?
-                if self.__r_to_y(start_r)**2 + x**2 > self.__max_radius_sqred + 0.5:
-                    start_r += 1
-                    continue
-
-                cclear = self.__dm.is_open(start_r, curr_col, self.level_num)
-
-                if cclear != pclear:
-                    if pclear:
-                        n_eslope = self.__slope(x + 0.5,self.__r_to_y(start_r) + 0.5)
-                        # If we generate a n_eslope that is equal to the sslope,
-                        # tilt it a bit to avoid overly narrowing player's POV
-                        if n_eslope == sslope:
-                            n_eslope += self.__slope_tilt
-
-                        self.__shadowcast_o8(sslope,n_eslope,x - 1.0)
-                    else:
-                        sslope = self.__slope(x - 0.5,self.__r_to_y(start_r) + 0.5)
-
-                self.__visible[start_r,curr_col] = 0
-
-                pclear = cclear
-                start_r += 1
-        
-            if not self.__dm.is_open(end_r, curr_col, self.level_num):
+            if not pclear:
                 break
 
-            x -= 1.0
+            d += 1
+
+# Monsters, turrets and cameras that aren't moving ask for the same field of 
+# view turn after turn, so each level keeps one of these. Results are keyed by
+# origin, radius, whether the view is symmetric and the level's 
+# terrain_version (which changes whenever a square's terrain does) so a stale
+# view can never be handed back, and the least recently used entries are 
+# dropped once max_entries is reached.
+#
+# Line of sight checks between two squares are cached the same way, and are 
+# answered from a cached field of view when there is one. For symmetric 
+# checks that includes a symmetric view from the target's square.
+#
+# The dict handed back by calc_visible_list() is shared with the cache, so 
+# callers must not modify it.
+class FOVCache(object):
+    def __init__(self, level, max_entries=128):
+        self.level = level
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__los = OrderedDict()
+        self.__symmetric_radii = {}
+        self.__version = level.terrain_version
+
+    def __check_version(self):
+        if self.level.terrain_version != self.__version:
+            # Nothing cached under an older version can be asked for again
+            self.clear()
+            self.__version = self.level.terrain_version
+
+    def __lookup(self, cache, key):
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+
+        return None
+
+    def __store(self, cache, key, value):
+        self.misses += 1
+        cache[key] = value
+        if len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def calc_visible_list(self, radius, row, col, symmetric=False):
+        self.__check_version()
+        _key = (row, col, radius, symmetric, self.__version)
+        _visible = self.__lookup(self.__entries, _key)
+        if _visible is None:
+            _sc = Shadowcaster(self.level.dm, radius, row, col, self.level.level_num, symmetric)
+            _visible = _sc.calc_visible_list()
+            self.__store(self.__entries, _key, _visible)
+            if symmetric:
+                self.__symmetric_radii[(row, col)] = radius
+
+        return _visible
+
+    # If there's a symmetric view from the target's square that reaches back
+    # to (row, col), it already knows the answer. Symmetry only holds for the
+    # symmetric scan, and only between open squares: a wall shows up in the 
+    # view but can't see out.
+    def __look_back(self, row, col, target_r, target_c, dist_sqred, symmetric):
+        if not symmetric:
+            return None
+        _opaque = self.level.opaque
+        _width = self.level.layer_width
+        if _opaque[row * _width + col] or _opaque[target_r * _width + target_c]:
+            return None
+
+        _radius = self.__symmetric_radii.get((target_r, target_c))
+        if _radius is None or dist_sqred > _radius * _radius:
+            return None
+
+        _key = (target_r, target_c, _radius, symmetric, self.__version)
+        if _key not in self.__entries:
+            return None
+
+        return (row, col) in self.__lookup(self.__entries, _key)
+
+    def can_see(self, radius, row, col, target_r, target_c, symmetric=False):
+        self.__check_version()
+        _fov_key = (row, col, radius, symmetric, self.__version)
+        if _fov_key in self.__entries:
+            return (target_r, target_c) in self.__lookup(self.__entries, _fov_key)
+
+        if symmetric:
+            _dist_sqred = (row - target_r) ** 2 + (col - target_c) ** 2
+            if _dist_sqred > radius * radius:
+                return False
+            _seen = self.__look_back(row, col, target_r, target_c, _dist_sqred, symmetric)
+            if _seen is not None:
+                return _seen
+
+        _key = (row, col, radius, target_r, target_c, symmetric, self.__version)
+        _seen = self.__lookup(self.__los, _key)
+        if _seen is None:
+            _sc = Shadowcaster(self.level.dm, radius, row, col, self.level.level_num, symmetric)
+            _seen = _sc.is_visible(target_r, target_c)
+            self.__store(self.__los, _key, _seen)
+
+        return _seen
+
+    def get_stats(self):
+        _total = self.hits + self.misses
+        _rate = float(self.hits) / _total if _total > 0 else 0.0
+
+        return (self.hits, self.misses, _rate, len(self.__entries) + len(self.__los))
+
+    def clear(self):
+        self.__entries.clear()
+        self.__los.clear()
+        self.__symmetric_radii.clear()
@@ -19,6 +19,7 @@ from random import randrange
 
 from .GameLevel import GameLevel
 from .RLDungeonGenerator import RLDungeonGenerator
+from .RoomGraph import squares_in_rect
 from .Terrain import BossTerminal
 from .Terrain import TerrainFactory
 from .Terrain import DOWN_STAIRS, UP_STAIRS
@@ -37,6 +38,8 @@ class FinalComplexLevel(GameLevel):
         dg = RLDungeonGenerator(self.lvl_width, self.lvl_length)
         dg.generate_map()
         self.map = dg.map
+        self.set_room_layout(squares_in_rect(_room.row, _room.col, _room.height, _room.width) 
+                                for _room in dg.rooms)
 
     	# Add location of the down stairs
         p = self.place_sqr(tf.get_terrain_tile(DOWN_STAIRS), FLOOR)        
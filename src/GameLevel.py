@@ -15,6 +15,11 @@
 # You should have received a copy of the GNU General Public License
 # along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+from bisect import bisect_right
+from heapq import heappop
+from heapq import heappush
+
 from .CombatResolver import MeleeResolver
 from . import Agent
 from . import Items
@@ -31,7 +36,14 @@ from .Terrain import GRASS
 from .Terrain import ROAD
 from .Terrain import UP_STAIRS
 from .Terrain import DOWN_STAIRS
-from .FieldOfView import Shadowcaster
+from .DistanceField import DistanceField
+from .DistanceField import SafetyMap
+from .FieldOfView import FOVCache
+from .PathCache import PathCache
+from .RandomSet import RandomSet
+from .RoomGraph import RoomGraph
+from .Scheduler import Scheduler
+from .FieldOfView import SYMMETRIC_VISION
 from .Terrain import TerrainTile
 from . import MonsterFactory
 from .Util import calc_distance
@@ -50,12 +62,18 @@ class Noise(object):
         self.col = col
         self.description = description
         
-# Override the basic list structure to make a sort of priority queue
-# (so items stacked in a pile are stored sorted by category, which is
-# handy for display purposes)
+# The items on a square, kept sorted by category. Alongside the items it keeps
+# their categories (so the right spot for a new item can be found with a 
+# binary search) and the stacks of stackable items by signature (so a new 
+# one can be merged without trying each stack in turn). Removing items 
+# through pop(), remove() or del keeps both up to date. A stack's signature 
+# can change while it sits here (if its items are altered, say) so the index
+# is only a hint, and it's rebuilt whenever it can't find a match.
 class ItemStack(list):
     def __init__(self):
         list.__init__(self)
+        self.__categories = []
+        self.__stacks = {}
         
     def append(self,item):
         if item.is_stackable():
@@ -64,44 +82,172 @@ class ItemStack(list):
             self.__add_item(item)
 
     def __add_item(self,item):
-        if len(self) == 0:
-            list.append(self,item)
-        else:
-            self.__find_place(item)
-
-    def __find_place(self,item):
         c = item.get_category()
-
-        for i in range(0,len(self)):
-            if c < self[i].get_category():
-                break
-
+        i = bisect_right(self.__categories, c)
+        self.__categories.insert(i, c)
         list.insert(self,i,item)
 
     def __find_stack(self,item):
         new_stack = Items.ItemStack(item)
+        _sig = new_stack.get_signature()
+        _stack = self.__stacks.get(_sig)
+        if _stack is None or _stack.get_signature() != _sig:
+            self.__reindex()
+            _stack = self.__stacks.get(_sig)
+        if _stack is not None:
+            _stack.add_item(new_stack)
+            return
 
-        for i in self:
-            try:
-                # Unfortunately, boxes also have an add_item event.  This
-                # prevents an infinite looop
-                if not isinstance(i,Items.Box):
-                    i.add_item(new_stack)
-                    return
-            except AttributeError:
-                continue
-            except Items.StackItemsMustBeIdentical:
-                continue
-
+        self.__stacks[_sig] = new_stack
         self.__add_item(new_stack)
+
+    def __reindex(self):
+        self.__stacks = {}
+        for _item in self:
+            if isinstance(_item, Items.ItemStack):
+                self.__stacks.setdefault(_item.get_signature(), _item)
+
+    def __forget(self, item):
+        for _sig in [_s for _s in self.__stacks if self.__stacks[_s] is item]:
+            del self.__stacks[_sig]
+
+    def pop(self, i=-1):
+        _item = list.pop(self, i)
+        self.__categories.pop(i)
+        self.__forget(_item)
+        return _item
+
+    def remove(self, item):
+        self.pop(self.index(item))
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            for _j in sorted(range(*i.indices(len(self))), reverse=True):
+                self.pop(_j)
+        else:
+            self.pop(i)
         
-class DungeonSqr:
-    def __init__(self,visible,visited,lit):
-        self.occupant = ''
-        self.visible = visible
-        self.visited = visited
-        self.lit = lit
-        self.temp_tile = '' # used for transitory tiles, like a knife thrown through the air
+# A row of the level's map. It doesn't hold any tiles itself, it just lets
+# map[r][c] (and map[r][c] = tile) keep working on top of the level's 
+# tile storage.
+class MapRow(object):
+    def __init__(self, level, row):
+        self.level = level
+        self.row = row
+
+    def __check_col(self, col):
+        _width = self.level.layer_width
+        if col < 0:
+            col += _width
+        if col < 0 or col >= _width:
+            raise IndexError('map column out of range')
+        return col
+
+    def __getitem__(self, col):
+        return self.level.get_tile(self.row, self.__check_col(col))
+
+    def __setitem__(self, col, tile):
+        self.level.set_tile(self.row, self.__check_col(col), tile)
+
+    def __len__(self):
+        return self.level.layer_width
+
+    def __iter__(self):
+        for _c in range(self.level.layer_width):
+            yield self.level.get_tile(self.row, _c)
+
+# What the level knows about a square besides its terrain. The state itself
+# lives in the level (flag layers for visible/visited/lit and dicts for the
+# occupants, temp tiles and item stacks, since most squares have none), this
+# is just a view of one square for code that wants dungeon_loc[r][c].
+class DungeonSqr(object):
+    __slots__ = ('level', 'index', 'saved')
+
+    def __init__(self, level, index):
+        self.level = level
+        self.index = index
+
+    # Squares pickled by older versions held their own state, which is kept
+    # here until GameLevel.load_old_locs_save_obj() moves it into the level
+    def __setstate__(self, state):
+        self.saved = state
+
+    @property
+    def occupant(self):
+        return self.level.occupants.get(self.index, '')
+
+    @occupant.setter
+    def occupant(self, agent):
+        _r, _c = divmod(self.index, self.level.lvl_width)
+        self.level.set_occupant(_r, _c, agent)
+
+    @property
+    def visible(self):
+        return self.level.visible_flags[self.index] == 1
+
+    @visible.setter
+    def visible(self, value):
+        self.level.visible_flags[self.index] = 1 if value else 0
+
+    @property
+    def visited(self):
+        return self.level.visited_flags[self.index] == 1
+
+    @visited.setter
+    def visited(self, value):
+        self.level.visited_flags[self.index] = 1 if value else 0
+
+    @property
+    def lit(self):
+        return self.level.lit_flags[self.index] == 1
+
+    @lit.setter
+    def lit(self, value):
+        self.level.lit_flags[self.index] = 1 if value else 0
+
+    # used for transitory tiles, like a knife thrown through the air
+    @property
+    def temp_tile(self):
+        return self.level.temp_tiles.get(self.index, '')
+
+    @temp_tile.setter
+    def temp_tile(self, tile):
+        if tile == '':
+            self.level.temp_tiles.pop(self.index, None)
+        else:
+            self.level.temp_tiles[self.index] = tile
+
+    # A square only has an item_stack once something has been dropped on it
+    @property
+    def item_stack(self):
+        try:
+            return self.level.item_stacks[self.index]
+        except KeyError:
+            raise AttributeError('item_stack')
+
+    @item_stack.setter
+    def item_stack(self, stack):
+        self.level.item_stacks[self.index] = stack
+
+class DungeonSqrRow(object):
+    def __init__(self, level, row):
+        self.level = level
+        self.row = row
+
+    def __getitem__(self, col):
+        _width = self.level.lvl_width
+        if col < 0:
+            col += _width
+        if col < 0 or col >= _width:
+            raise IndexError('dungeon_loc column out of range')
+        return DungeonSqr(self.level, self.row * _width + col)
+
+    def __len__(self):
+        return self.level.lvl_width
+
+    def __iter__(self):
+        for _c in range(self.level.lvl_width):
+            yield DungeonSqr(self.level, self.row * self.level.lvl_width + _c)
         
 class ItemChart:
     def __init__(self):
@@ -133,11 +279,37 @@ class ItemChart:
         return _item
 
 class GameLevel:
+    # Occupants are also filed into square buckets this many squares across,
+    # so that finding who is near a spot only looks at nearby buckets
+    OCCUPANT_BUCKET_SIZE = 8
+
+    # How many distance fields and safety maps to hang on to
+    DISTANCE_FIELDS_KEPT = 8
+
+    # Levels with at least this much of the map passable count as open ground
+    OPEN_GROUND_RATIO = 0.6
+
+    # Monsters with nothing to do (see BaseMonster.is_idle()) are put to 
+    # sleep every DORMANCY_CHECK turns and cost nothing until something wakes
+    # them: a noise, getting hurt, the player coming within interest_radius 
+    # where they can see him, or DORMANT_TURNS going by. The interest radius 
+    # should be at least as wide as the furthest any monster can see.
+    DORMANCY_CHECK = 10
+    DORMANT_TURNS = 100
+    INTEREST_RADIUS = 12
+    REGEN_TURNS = 50
+
+    # Limits on how much happens to a level while the player is away (see
+    # catch_up()), so that coming back costs the same however long it's been
+    MAX_CATCH_UP_SPAWNS = 4
+    MAX_WANDER_STEPS = 20
+
     def __init__(self, dm, level_num, length, width, category):
         self.dm = dm
         self.cameras = {}
         self.light_sources = []
         self.security_lockdown = False
+        self.terrain_version = 0
         self.map = []
         self.lvl_length = length
         self.lvl_width = width
@@ -151,6 +323,175 @@ class GameLevel:
         self.security_active = True
         self.entrance = None
         self.exit = None
+        self.fov_cache = FOVCache(self)
+        self.path_cache = PathCache(self)
+        self.scheduler = Scheduler()
+        self.interest_radius = self.INTEREST_RADIUS
+        self.dormant = {}
+        self.__wake_timers = []
+        self.last_turn = dm.turn
+        self.__distance_fields = {}
+        self.__distance_version = -1
+        self.__walkable_grid = None
+        self.__walkable_version = -1
+        self.__open_ground = False
+        self.room_layout = []
+        self.__room_graph = None
+        self.__room_graph_version = -1
+
+    # Alongside the map, each level keeps flat layers (one byte per square,
+    # indexed by r * layer_width + c) saying whether a square is opaque, 
+    # passable, open (can things fly over it) and toxic, so the hot paths 
+    # don't have to ask the tiles. Assigning a new map rebuilds them and 
+    # changing a square via map[r][c] = tile keeps them up to date. Anything
+    # that alters a tile in place (opening a door, say) needs to call 
+    # terrain_changed() itself. terrain_version is bumped on every change so
+    # anything cached off the terrain knows when it's out of date.
+    #
+    # The tiles themselves aren't stored as a grid either. Plain terrain 
+    # (floors, walls, water...) is shared out of the TerrainFactory, so all a 
+    # square needs is its tile type, kept in a flat array laid out like the 
+    # layers. Tiles with state of their own (doors, stairs, traps, terminals,
+    # cameras, subnet nodes) are kept in a dict by index. map[r][c] looks in 
+    # the dict first and falls back to the shared tile for the type.
+    @property
+    def map(self):
+        return self.__map
+
+    @map.setter
+    def map(self, tiles):
+        self.layer_length = len(tiles)
+        self.layer_width = len(tiles[0]) if tiles else 0
+        _size = self.layer_length * self.layer_width
+        self.__shared_tiles = TerrainFactory().get_terrain_cache()
+        self.__tile_types = array('b', [0]) * _size
+        self.__stateful_tiles = {}
+        self.__features = {}
+        self.__sqrs_by_type = {}
+        self.__vacant_sqrs = RandomSet()
+        self.opaque = bytearray(_size)
+        self.passable = bytearray(_size)
+        self.open = bytearray(_size)
+        self.toxic = bytearray(_size)
+        for r, _row in enumerate(tiles):
+            for c, _tile in enumerate(_row):
+                self.__store_tile(r, c, _tile)
+                self.__update_layers(r, c)
+        self.__map = [MapRow(self, r) for r in range(self.layer_length)]
+        self.terrain_version += 1
+        self.rebuild_light_map()
+
+    def __store_tile(self, r, c, tile):
+        _i = r * self.layer_width + c
+        _type = tile.get_type()
+        if _i in self.__sqrs_by_type.get(self.__tile_types[_i], ()):
+            self.__sqrs_by_type[self.__tile_types[_i]].discard(_i)
+        self.__sqrs_by_type.setdefault(_type, RandomSet()).add(_i)
+        self.__tile_types[_i] = _type
+        if _i in self.__stateful_tiles:
+            self.__index_feature(_i, self.__stateful_tiles.pop(_i), False)
+        if type(tile) is not TerrainTile or _type not in self.__shared_tiles:
+            self.__stateful_tiles[_i] = tile
+            self.__index_feature(_i, tile, True)
+
+    # Stateful tiles are also indexed by their tile type and by their class 
+    # (and its parent classes, so Trap finds holes and mines too), which 
+    # lets stairs, terminals and the like be found without a scan.
+    def __index_feature(self, i, tile, add):
+        _kinds = [tile.get_type()]
+        _kinds += [_k for _k in type(tile).__mro__ if issubclass(_k, TerrainTile) and _k is not TerrainTile]
+        for _kind in _kinds:
+            if add:
+                self.__features.setdefault(_kind, {})[i] = tile
+            else:
+                _locs = self.__features[_kind]
+                del _locs[i]
+                if not _locs:
+                    del self.__features[_kind]
+
+    # Where the tiles of a kind (a tile type, or a class of tile) are, in map 
+    # order
+    def find_features(self, kind):
+        return [divmod(_i, self.layer_width) for _i in sorted(self.__features.get(kind, {}))]
+
+    def get_tile(self, r, c):
+        _i = r * self.layer_width + c
+        _tile = self.__stateful_tiles.get(_i)
+        if _tile is None:
+            _tile = self.__shared_tiles[self.__tile_types[_i]]
+        return _tile
+
+    def set_tile(self, r, c, tile):
+        self.__store_tile(r, c, tile)
+        self.terrain_changed(r, c)
+
+    def get_tile_type(self, r, c):
+        return self.__tile_types[r * self.layer_width + c]
+
+    # Saves only need the tile types and the stateful tiles rather than a 
+    # pickled tile for every square
+    def get_map_save_obj(self):
+        return (self.layer_width, self.__tile_types.tobytes(), self.__stateful_tiles)
+
+    def load_map_save_obj(self, obj):
+        _width, _types, _stateful = obj
+        _tile_types = array('b')
+        _tile_types.frombytes(_types)
+        _shared = TerrainFactory().get_terrain_cache()
+        _tiles = [_stateful[_i] if _i in _stateful else _shared[_tile_types[_i]] for _i in range(len(_tile_types))]
+        self.map = [_tiles[_r:_r + _width] for _r in range(0, len(_tiles), _width)]
+
+    def terrain_changed(self, r, c):
+        self.__update_layers(r, c)
+        self.terrain_version += 1
+        self.__relight_near(r, c)
+
+    def __update_layers(self, r, c):
+        _tile = self.get_tile(r, c)
+        _i = r * self.layer_width + c
+        self.opaque[_i] = 1 if _tile.is_opaque() else 0
+        self.passable[_i] = 1 if _tile.is_passable() else 0
+        self.open[_i] = 1 if _tile.is_open() else 0
+        self.toxic[_i] = 1 if _tile.is_toxic() else 0
+        self.__update_vacancy(r, c)
+
+    # A square is vacant if a monster could be put there: it's passable, 
+    # unoccupied and not a lift (so nothing is waiting on the lift when the 
+    # player arrives)
+    def __update_vacancy(self, r, c):
+        _i = r * self.layer_width + c
+        if self.passable[_i] and self.__tile_types[_i] not in (UP_STAIRS, DOWN_STAIRS) and self.get_occupant(r, c) == '':
+            self.__vacant_sqrs.add(_i)
+        else:
+            self.__vacant_sqrs.discard(_i)
+
+    # Pick a random square out of sqrs (a RandomSet of square indices) that
+    # passes test, or None if there isn't one. Most picks pass, so only fall
+    # back to checking every square after a run of bad luck.
+    def __random_sqr(self, sqrs, test=None):
+        for _j in range(10):
+            _i = sqrs.choice()
+            if _i is None:
+                return None
+            if test is None or test(_i):
+                return divmod(_i, self.layer_width)
+
+        _passing = [_i for _i in sqrs if test(_i)]
+        return divmod(choice(_passing), self.layer_width) if _passing else None
+
+    def __is_interior(self, i):
+        _r, _c = divmod(i, self.layer_width)
+        return 0 < _r < self.lvl_length - 1 and 0 < _c < self.lvl_width - 1
+
+    # A random square of the given tile type, or None if there aren't any
+    def random_sqr_of_type(self, tile_type, interior=False):
+        _sqrs = self.__sqrs_by_type.get(tile_type, RandomSet())
+        return self.__random_sqr(_sqrs, self.__is_interior if interior else None)
+
+    # A random square a monster could be placed on, or None if the level is 
+    # full
+    def random_vacant_sqr(self, interior=False):
+        return self.__random_sqr(self.__vacant_sqrs, self.__is_interior if interior else None)
 
     # These next two functions are the "altitude" of the dungeon because after the
     # Proving Grounds the floors are like a tower that go up higher. (Whereas level_num
@@ -162,18 +503,12 @@ class GameLevel:
         return self.level_num - 1 if self.level_num < 14 else self.level_num + 1
 
     def find_up_stairs_loc(self):
-        for r in range(self.lvl_length):
-            for c in range(self.lvl_width):
-                _sqr = self.map[r][c]
-                if _sqr.get_type() == UP_STAIRS or isinstance(_sqr, Terrain.HoleInCeiling):
-                    return (r, c)
+        _locs = self.find_features(UP_STAIRS) + self.find_features(Terrain.HoleInCeiling)
+        return min(_locs) if _locs else None
         
     def find_down_stairs_loc(self):
-        for r in range(self.lvl_length):
-            for c in range(self.lvl_width):
-                _sqr = self.map[r][c]
-                if _sqr.get_type() == DOWN_STAIRS or isinstance(_sqr, Terrain.GapingHole):
-                    return (r, c)
+        _locs = self.find_features(DOWN_STAIRS) + self.find_features(Terrain.GapingHole)
+        return min(_locs) if _locs else None
 
     def get_entrance(self):
         if not self.entrance:
@@ -217,9 +552,10 @@ class GameLevel:
         self.monsters_react_to_noise(_radius, _noise)
         
     def monsters_react_to_noise(self, radius, noise):
-        for _m in self.monsters:
-            _d = calc_distance(noise.row, noise.col, _m.row, _m.col)
-            if _d <= radius:
+        for _m in self.agents_within(noise.row, noise.col, radius):
+            # Every monster on the level is either in the scheduler or asleep
+            # (which also leaves out the player, or the robot they're running)
+            if _m in self.scheduler or _m in self.dormant:
                 _spotted = _m.react_to_noise(noise)
                 # I can later use success or failure of action to count
                 # as practice toward the player improving his skills
@@ -233,10 +569,11 @@ class GameLevel:
         return False
         
     def add_item_to_sqr(self, row, col, item):
-        if not hasattr(self.dungeon_loc[row][col], 'item_stack'):
-            setattr(self.dungeon_loc[row][col], 'item_stack', ItemStack())
+        _i = row * self.lvl_width + col
+        if _i not in self.item_stacks:
+            self.item_stacks[_i] = ItemStack()
             
-        self.dungeon_loc[row][col].item_stack.append(item)
+        self.item_stacks[_i].append(item)
     
     def thing_falls_in_hole(self, thing):
         _next_level_num = self.get_next_deeper_level_num()
@@ -277,13 +614,177 @@ class GameLevel:
         self.dm.update_sqr(self, row, col)
         
     def size_of_item_stack(self, row, col):
-        _loc = self.dungeon_loc[row][col]
-        return 0 if not hasattr(_loc, 'item_stack') else len(_loc.item_stack)
+        _stack = self.item_stacks.get(row * self.lvl_width + col)
+        return 0 if _stack is None else len(_stack)
+
+    # The item drawn for the square: the last one in the stack
+    def top_item(self, row, col):
+        _stack = self.item_stacks.get(row * self.lvl_width + col)
+        return _stack[-1] if _stack else None
+
+    def clear_item_stack(self, row, col):
+        self.item_stacks.pop(row * self.lvl_width + col, None)
+
+    # The squares with items on them, in map order. Squares whose stacks have
+    # been emptied are dropped from item_stacks along the way.
+    def get_item_locs(self):
+        for _i in [_i for _i in self.item_stacks if not self.item_stacks[_i]]:
+            del self.item_stacks[_i]
+
+        return [divmod(_i, self.lvl_width) for _i in sorted(self.item_stacks)]
         
-    def add_light_source(self, light_source):
-        _sc = Shadowcaster(self.dm, light_source.radius, light_source.row, light_source.col, self.level_num)
-        light_source.illuminates = _sc.calc_visible_list()
+    # The squares visible from (row, col). This goes through the level's FOV
+    # cache, so the dict returned must not be modified.
+    def calc_visible_list(self, radius, row, col, symmetric=False):
+        return self.fov_cache.calc_visible_list(radius, row, col, symmetric)
+
+    # Can something at (row, col) with the given vision radius see the 
+    # target square? Same answer as checking calc_visible_list() but usually 
+    # much cheaper.
+    def can_see(self, radius, row, col, target_r, target_c, symmetric=False):
+        return self.fov_cache.can_see(radius, row, col, target_r, target_c, symmetric)
+
+    # The squares that can be walked on (passable and not toxic) as a 
+    # bytearray, with a border of unwalkable squares all the way round so a 
+    # search can scan across it without checking bounds. It's laid out 
+    # layer_width + 2 wide, so (r, c) is at (r + 1) * (layer_width + 2) + c + 1.
+    # Rebuilt when the terrain changes.
+    def get_walkable_grid(self):
+        if self.__walkable_version != self.terrain_version:
+            _width = self.layer_width
+            _grid = bytearray(_width + 2)
+            for _r in range(self.layer_length):
+                _start = _r * _width
+                _grid.append(0)
+                _grid.extend(_p > _t for _p, _t in zip(self.passable[_start:_start + _width], 
+                                                        self.toxic[_start:_start + _width]))
+                _grid.append(0)
+            _grid.extend(bytearray(_width + 2))
+
+            self.__walkable_grid = bytes(_grid)
+            self.__walkable_version = self.terrain_version
+            _squares = _width * self.layer_length
+            self.__open_ground = _squares > 0 and \
+                float(sum(self.passable)) / _squares >= self.OPEN_GROUND_RATIO
+
+        return self.__walkable_grid
+
+    # Mostly open levels, where Jump Point Search beats plain A*
+    def is_open_ground(self):
+        self.get_walkable_grid()
+        return self.__open_ground
+
+    # Levels whose generator knows where it put the rooms hand them over as 
+    # lists of squares, so that long paths can be planned room by room (see
+    # RoomGraph). 
+    def set_room_layout(self, rooms):
+        self.room_layout = [list(_room) for _room in rooms]
+        self.__room_graph = None
+        self.__room_graph_version = -1
+
+    # None for levels without a room layout. The graph is rebuilt when next 
+    # asked for after the terrain changes.
+    def get_room_graph(self):
+        if not self.room_layout:
+            return None
+
+        if self.__room_graph_version != self.terrain_version:
+            self.__room_graph = RoomGraph(self, self.room_layout)
+            self.__room_graph_version = self.terrain_version
+
+        return self.__room_graph
+
+    # Distance field leading to (row, col). Everything chasing the same thing
+    # shares one, and it's only rebuilt once the target moves or the terrain
+    # changes. Only the last few targets are kept around.
+    def get_distance_field(self, row, col):
+        return self.__get_field(DistanceField, row, col)
+
+    # Map for running away from (row, col), shared in the same way by 
+    # everything fleeing from it
+    def get_safety_map(self, row, col):
+        return self.__get_field(SafetyMap, row, col)
+
+    def __get_field(self, kind, row, col):
+        if self.__distance_version != self.terrain_version:
+            self.__distance_fields = {}
+            self.__distance_version = self.terrain_version
+
+        _field = self.__distance_fields.get((kind, row, col))
+        if _field is None:
+            if len(self.__distance_fields) >= self.DISTANCE_FIELDS_KEPT:
+                del self.__distance_fields[next(iter(self.__distance_fields))]
+            if kind is SafetyMap:
+                _field = SafetyMap(self, self.get_distance_field(row, col))
+            else:
+                _field = DistanceField(self, row, col)
+            self.__distance_fields[(kind, row, col)] = _field
+
+        return _field
+
+    # The light map counts how many light sources reach each square, so 
+    # whether a square is lit by something is a single lookup. It's updated
+    # as lights are added and doused, and when the terrain near a light 
+    # changes, the light is recalculated.
+    def rebuild_light_map(self):
+        self.light_map = array('H', [0]) * (self.layer_length * self.layer_width)
+        for _ls in self.light_sources:
+            self.__count_light(_ls, 1)
+
+    def is_lit(self, r, c):
+        if r < 0 or r >= self.layer_length or c < 0 or c >= self.layer_width:
+            return False
+
+        return self.light_map[r * self.layer_width + c] > 0
+
+    def __count_light(self, light_source, delta):
+        for _r, _c in light_source.illuminates:
+            if 0 <= _r < self.layer_length and 0 <= _c < self.layer_width:
+                self.light_map[_r * self.layer_width + _c] += delta
+
+    def __light(self, light_source):
+        _visible = self.calc_visible_list(light_source.radius, light_source.row, light_source.col)
+        light_source.illuminates = dict(_visible)
         light_source.illuminates[(light_source.row, light_source.col)] = 0
+        self.__count_light(light_source, 1)
+
+    def __relight_near(self, r, c):
+        for _ls in self.light_sources:
+            if (r - _ls.row) ** 2 + (c - _ls.col) ** 2 > _ls.radius ** 2:
+                continue
+
+            _prev = _ls.illuminates
+            self.__count_light(_ls, -1)
+            self.__light(_ls)
+            for _d in _prev:
+                if _d not in _ls.illuminates and not self.is_lit(_d[0], _d[1]) and self.in_bounds(_d[0], _d[1]):
+                    self.lit_flags[_d[0] * self.lvl_width + _d[1]] = 0
+
+    # Called once a turn before the monsters act. Monster vision is symmetric,
+    # so one view cast out from each target (the player, and the robot 
+    # they're running if there is one) answers every monster's "can I see 
+    # it?" check for the turn through the FOV cache, wherever the monster is 
+    # standing. The view only needs to reach as far as the longest sighted 
+    # monster close enough to see the target, and if there isn't one, nothing
+    # is cast at all.
+    def precompute_monster_vision(self, targets, monsters):
+        for _t in targets:
+            if _t.curr_level != self.level_num:
+                continue
+            _radius = 0
+            for _m in monsters:
+                if _m is _t or _m.vision_radius <= _radius:
+                    continue
+                _dr = _m.row - _t.row
+                _dc = _m.col - _t.col
+                if _dr * _dr + _dc * _dc <= _m.vision_radius * _m.vision_radius:
+                    _radius = _m.vision_radius
+
+            if _radius > 0:
+                self.fov_cache.calc_visible_list(_radius, _t.row, _t.col, SYMMETRIC_VISION)
+
+    def add_light_source(self, light_source):
+        self.__light(light_source)
         self.light_sources.append(light_source)
 
     def clear_bresenham_points(self, row, col, radius):
@@ -329,18 +830,124 @@ class GameLevel:
                 
     def douse_squares(self, ls):
         self.light_sources.remove(ls)
-        for _d in ls.illuminates:
-            self.dungeon_loc[_d[0]][_d[1]].lit = False
+        self.__count_light(ls, -1)
+        self.clear_lit(ls.illuminates)
+
+    def clear_lit(self, locs):
+        for _r, _c in locs:
+            self.lit_flags[_r * self.lvl_width + _c] = 0
+
+    # The player can see (r, c) right now
+    def mark_in_sight(self, r, c):
+        _i = r * self.lvl_width + c
+        self.visible_flags[_i] = 1
+        self.visited_flags[_i] = 1
+        self.lit_flags[_i] = 1
+
+    def mark_out_of_sight(self, r, c):
+        _i = r * self.lvl_width + c
+        self.visible_flags[_i] = 0
+        self.visited_flags[_i] = 1
+        self.lit_flags[_i] = 0
 
     def end_of_turn(self):
-        for _m in self.monsters:
+        self.last_turn = self.dm.turn
+        for _m in self.scheduler:
             _m.check_for_expired_conditions()
         
-        if self.dm.turn % 50 == 0:
-            for m in self.monsters:
+        if self.dm.turn % self.REGEN_TURNS == 0:
+            for m in self.scheduler:
                 m.regenerate()
             if random() < 0.5:
                 self.add_monster()
+
+        if self.dm.turn % self.DORMANCY_CHECK == 0:
+            self.park_idle_monsters(self.dm.get_true_player())
+
+    def park_idle_monsters(self, player):
+        for _m in self.scheduler:
+            if _m.is_idle() and not _m.is_agent_visible(player):
+                self.scheduler.remove(_m)
+                self.dormant[_m] = self.dm.turn
+                heappush(self.__wake_timers, (self.dm.turn + self.DORMANT_TURNS, id(_m), _m))
+
+    # Levels stand still while the player is elsewhere. When he comes back, 
+    # rather than play out every turn he missed, the level is brought up to
+    # date in one go: the healing and new arrivals it would have had, the 
+    # monsters' conditions running out, and the monsters that were up and 
+    # about having wandered off a ways. (Lights burning out are events, which
+    # happen whichever level they're on.) Sleeping monsters catch up when 
+    # they wake.
+    def catch_up(self):
+        if self.is_cyberspace():
+            return
+        _missed = self.dm.turn - 1 - self.last_turn
+        if _missed <= 0:
+            return
+
+        _regens = (self.dm.turn - 1) // self.REGEN_TURNS - self.last_turn // self.REGEN_TURNS
+        _steps = min(_missed, self.MAX_WANDER_STEPS)
+        for _m in self.scheduler:
+            for _j in range(min(_regens, _m.max_hp - _m.curr_hp)):
+                _m.regenerate()
+            _m.check_for_expired_conditions()
+            if not _m.is_idle() and not _m.stationary and not _m.has_condition('stunned'):
+                self.__wander(_m, _steps)
+
+        # Each chance at a new monster is a coin flip
+        _spawns = sum(1 for _j in range(min(_regens, 2 * self.MAX_CATCH_UP_SPAWNS)) if random() < 0.5)
+        for _j in range(min(_spawns, self.MAX_CATCH_UP_SPAWNS)):
+            self.add_monster()
+
+        self.last_turn = self.dm.turn - 1
+
+    # A random walk of up to steps moves, avoiding toxic squares
+    def __wander(self, monster, steps):
+        _r, _c = monster.row, monster.col
+        for _j in range(steps):
+            _nr = _r + randrange(-1, 2)
+            _nc = _c + randrange(-1, 2)
+            if (_nr, _nc) == (monster.row, monster.col):
+                _r, _c = _nr, _nc
+            elif self.is_clear(_nr, _nc) and not self.toxic[_nr * self.layer_width + _nc]:
+                _r, _c = _nr, _nc
+
+        if (_r, _c) != (monster.row, monster.col):
+            self.dungeon_loc[monster.row][monster.col].occupant = ''
+            monster.row, monster.col = _r, _c
+            self.dungeon_loc[_r][_c].occupant = monster
+
+    # Called before the monsters take their turn, so anything woken gets to
+    # act right away
+    def wake_dormant_monsters(self, targets):
+        if not self.dormant:
+            return
+
+        while self.__wake_timers and self.__wake_timers[0][0] <= self.dm.turn:
+            _wake, _id, _m = heappop(self.__wake_timers)
+            if self.dormant.get(_m, None) == _wake - self.DORMANT_TURNS:
+                self.wake_monster(_m)
+
+        for _t in targets:
+            if _t.curr_level != self.level_num:
+                continue
+            for _m in self.agents_within(_t.row, _t.col, self.interest_radius):
+                if _m in self.dormant and _m.is_agent_visible(_t):
+                    self.wake_monster(_m)
+
+    # Brings a sleeping monster up to date in one go (the conditions that ran
+    # out and the healing it missed while asleep) and gives it turns again
+    def wake_monster(self, monster):
+        _parked = self.dormant.pop(monster, None)
+        if _parked is None:
+            return
+
+        # If it's woken before this turn's healing, it'll get that along 
+        # with everyone else
+        for _j in range((self.dm.turn - 1) // self.REGEN_TURNS - _parked // self.REGEN_TURNS):
+            monster.regenerate()
+        monster.check_for_expired_conditions()
+        self.scheduler.add(monster)
             
     def end_security_lockdown(self):
         self.security_lockdown = False
@@ -359,14 +966,20 @@ class GameLevel:
                 
     # this could maybe be moved to GamePersistence?
     def generate_save_object(self):
+        for _m in list(self.dormant):
+            self.wake_monster(_m)
+        self.scheduler.settle_all()
         for m in self.monsters:
             m.dm = ''
 
         self.clear_occupants()
         _exit_point = (self.dm.player.row, self.dm.player.col)
-        _save_obj = (self.map,self.dungeon_loc,self.light_sources,self.monsters, 
+        _map = self.get_map_save_obj()
+        self.get_item_locs()
+        _locs = (self.visible_flags, self.visited_flags, self.lit_flags, self.temp_tiles, self.item_stacks)
+        _save_obj = (_map,_locs,self.light_sources,self.monsters, 
                 self.category,self.level_num,_exit_point,self.cameras, self.security_lockdown, self.subnet_nodes, 
-                self.cameras_active, self.security_active)
+                self.cameras_active, self.security_active, self.room_layout, self.last_turn)
 
         return _save_obj
         
@@ -386,54 +999,105 @@ class GameLevel:
             if _radius > 10: return None
 
     def get_occupant(self, r, c):
-        return self.dungeon_loc[r][c].occupant
+        return self.occupants.get(r * self.lvl_width + c, '')
+
+    def set_occupant(self, r, c, agent):
+        _i = r * self.lvl_width + c
+        _key = (r // self.OCCUPANT_BUCKET_SIZE, c // self.OCCUPANT_BUCKET_SIZE)
+        if _i in self.occupants:
+            del self.occupants[_i]
+            del self.__occupant_buckets[_key][_i]
+        if agent != '':
+            self.occupants[_i] = agent
+            self.__occupant_buckets.setdefault(_key, {})[_i] = agent
+        self.__update_vacancy(r, c)
+
+    # Everyone within radius of (r, c), by the same measure as calc_distance()
+    def agents_within(self, r, c, radius):
+        _agents = []
+        _reach = int(radius)
+        _limit = (_reach + 1) ** 2
+        _size = self.OCCUPANT_BUCKET_SIZE
+        for _br in range((r - _reach) // _size, (r + _reach) // _size + 1):
+            for _bc in range((c - _reach) // _size, (c + _reach) // _size + 1):
+                for _i, _agent in self.__occupant_buckets.get((_br, _bc), {}).items():
+                    _ar, _ac = divmod(_i, self.lvl_width)
+                    if (_ar - r) ** 2 + (_ac - c) ** 2 < _limit:
+                        _agents.append(_agent)
+
+        return _agents
+
+    # The closest agent within radius of (r, c) that passes test (if given),
+    # or None. Buckets are searched in rings outward from (r, c) and the 
+    # search stops once a ring can't hold anything closer than what's been
+    # found.
+    def nearest_agent(self, r, c, radius, test=None):
+        _best = None
+        _best_d = None
+        _limit = (int(radius) + 1) ** 2
+        _size = self.OCCUPANT_BUCKET_SIZE
+        _br, _bc = r // _size, c // _size
+        for _ring in range(int(radius) // _size + 2):
+            if _best is not None and _ring > 0 and _best_d < ((_ring - 1) * _size + 1) ** 2:
+                break
+            for _dr in range(-_ring, _ring + 1):
+                for _dc in range(-_ring, _ring + 1):
+                    if max(abs(_dr), abs(_dc)) != _ring:
+                        continue
+                    for _i, _agent in self.__occupant_buckets.get((_br + _dr, _bc + _dc), {}).items():
+                        _ar, _ac = divmod(_i, self.lvl_width)
+                        _d = (_ar - r) ** 2 + (_ac - c) ** 2
+                        if _d >= _limit or (_best is not None and _d >= _best_d):
+                            continue
+                        if test is None or test(_agent):
+                            _best = _agent
+                            _best_d = _d
+
+        return _best
         
     def is_clear(self, r, c, ignore_occupants=False):
         if not self.in_bounds(r,c):
             return False
         
         if ignore_occupants:
-            return self.map[r][c].is_passable()
+            return self.passable[r * self.layer_width + c] == 1
         else:
-            return self.map[r][c].is_passable() and self.dungeon_loc[r][c].occupant == ''
+            return self.passable[r * self.layer_width + c] == 1 and self.get_occupant(r, c) == ''
 
     def is_clear_for_agent(self, r, c, agent):
         if not self.in_bounds(r,c):
             return False
-        if agent == self.dungeon_loc[r][c].occupant:
+        _occ = self.get_occupant(r, c)
+        if agent == _occ:
             return True
             
-        return self.map[r][c].is_passable() and self.dungeon_loc[r][c].occupant == ''
+        return self.passable[r * self.layer_width + c] == 1 and _occ == ''
         
+    # Returns where sqr was placed, or None if there was no square of 
+    # target_type to put it on
     def place_sqr(self, sqr, target_type):
-        while True:
-            r = randrange(1, self.lvl_length-1)
-            c = randrange(1, self.lvl_width-1)
-            
-            if self.map[r][c].get_type() == target_type: break
-        self.map[r][c] = sqr
+        _loc = self.random_sqr_of_type(target_type, True)
+        if _loc is not None:
+            self.map[_loc[0]][_loc[1]] = sqr
         
-        return (r, c)
+        return _loc
         
     def remove_monster(self, monster, row, col):
         self.dungeon_loc[row][col].occupant = ''
         self.monsters.remove(monster)
+        self.scheduler.remove(monster)
+        self.dormant.pop(monster, None)
 
     def clear_occupants(self):
-        for row in self.dungeon_loc:
-            for cell in row:
-                cell.occupant = ''
+        for _i in list(self.occupants):
+            _r, _c = divmod(_i, self.lvl_width)
+            self.set_occupant(_r, _c, '')
     
     def add_feature_to_map(self, feature):
-        while True:
-            r = randrange(1,self.lvl_length-1)
-            c = randrange(1,self.lvl_width-1)
-
-            if self.map[r][c].get_type() == FLOOR:
-                feature.row = r
-                feature.col = c
-                self.map[r][c] = feature
-                break
+        _loc = self.random_sqr_of_type(FLOOR, True)
+        if _loc is not None:
+            feature.row, feature.col = _loc
+            self.map[_loc[0]][_loc[1]] = feature
 
     def remove_light_source(self, light_source):
         _target = ''
@@ -443,16 +1107,13 @@ class GameLevel:
                 
         if _target != '':
             self.light_sources.remove(_target)
+            self.__count_light(_target, -1)
 
     def add_item(self, _chart):
         _item = _chart.get_item(self.level_num)
-        while True:
-            r = randrange(self.lvl_length)
-            c = randrange(self.lvl_width)
-            
-            if self.map[r][c].get_type() == FLOOR:
-                self.add_item_to_sqr(r,c,_item)
-                break
+        _loc = self.random_sqr_of_type(FLOOR)
+        if _loc is not None:
+            self.add_item_to_sqr(_loc[0], _loc[1], _item)
                 
     def add_pack(self, monster_name, low, high, r, c):
         for j in range(randrange(low,high+1)):
@@ -461,29 +1122,15 @@ class GameLevel:
                 _monster = MonsterFactory.get_monster_by_name(self.dm, monster_name, _sqr[0], _sqr[1])  
                 self.add_monster_to_dungeon(_monster, _sqr[0], _sqr[1])
         
+    # If the level is full, the monster just isn't added
     def add_monster(self, monster=''):
-        # This loop currently doesn't handle the oddball case where the dungeon is full!
-        # Should be fixed, otherwise it will be an infinite loop, and unpleasant for the
-        # player!
-        
-        while True: 
-            try_r = randrange(0,self.lvl_length)
-            try_c = randrange(0,self.lvl_width)
-            _sqr = self.map[try_r][try_c]
-
-            # This'll prevent a monster from being generated where the player will
-            # appear when first entering the level
-            if _sqr.get_type() in (UP_STAIRS, DOWN_STAIRS):
-                continue
-                
-            if self.is_clear(try_r,try_c):
-                r = try_r
-                c = try_c
-                break
+        _loc = self.random_vacant_sqr()
+        if _loc is None:
+            return
             
         if monster.level < self.level_num:
             monster.level = self.level_num
-        self.add_monster_to_dungeon(monster, r, c)
+        self.add_monster_to_dungeon(monster, _loc[0], _loc[1])
                 
     def add_monster_to_dungeon(self, monster, r, c):
         monster.row = r
@@ -491,14 +1138,31 @@ class GameLevel:
         monster.curr_level = self.level_num
         self.dungeon_loc[r][c].occupant = monster
         self.monsters.append(monster)
+        self.scheduler.add(monster)
 
     def initialize_dungeon_locs(self):
-        self.dungeon_loc = []
-        for r in range(0,self.lvl_length):
-            row = []
-            for c in range(0,self.lvl_width):
-                row.append(DungeonSqr(False, False, False))
-            self.dungeon_loc.append(row)
+        _size = self.lvl_length * self.lvl_width
+        self.load_locs_save_obj((bytearray(_size), bytearray(_size), bytearray(_size), {}, {}))
+
+    def load_locs_save_obj(self, obj):
+        self.visible_flags, self.visited_flags, self.lit_flags, self.temp_tiles, self.item_stacks = obj
+        self.occupants = {}
+        self.__occupant_buckets = {}
+        self.dungeon_loc = [DungeonSqrRow(self, r) for r in range(self.lvl_length)]
+
+    # The squares from a game saved when each one was its own object
+    def load_old_locs_save_obj(self, locs):
+        self.initialize_dungeon_locs()
+        for _r, _row in enumerate(locs):
+            for _c, _old in enumerate(_row):
+                _state = _old.saved
+                _loc = self.dungeon_loc[_r][_c]
+                _loc.visible = _state.get('visible', False)
+                _loc.visited = _state.get('visited', False)
+                _loc.lit = _state.get('lit', False)
+                _loc.temp_tile = _state.get('temp_tile', '')
+                for _item in _state.get('item_stack', []):
+                    self.add_item_to_sqr(_r, _c, _item)
             
     def begin_security_lockdown(self):
         pass
@@ -33,8 +33,10 @@ def save_preferences(prefs):
     _file.close()
     
 def get_preferences():
+    _defaults = {"auto unlock doors" : True, "bump to open doors" : True, "enter to clear pause" : True,
+        "show animations" : True}
     if not path.exists('prefs.txt'):
-        _prefs = {"auto unlock doors" : True, "bump to open doors" : True, "enter to clear pause" : True}
+        _prefs = _defaults
         save_preferences(_prefs)
     else:
         _prefs = {}
@@ -42,9 +44,29 @@ def get_preferences():
         for _line in _file.readlines():
             _parts = _line.split(":")
             _prefs[_parts[0].strip()] = _parts[1].strip().lower() == "true"
+        _file.close()
+
+        # A prefs file from an older version won't have the newer options
+        for _key in _defaults:
+            if _key not in _prefs:
+                _prefs[_key] = _defaults[_key]
     
     return _prefs
             
+# Games saved before the level's map and squares were packed into layers 
+# kept them as lists of rows of objects. They also didn't have the room 
+# layout or the turn the level was last brought up to date.
+def is_old_level_save(obj):
+    return isinstance(obj[0], list)
+
+def get_level_dimensions(obj):
+    if is_old_level_save(obj):
+        return len(obj[0]), len(obj[0][0])
+
+    # The compact map is (width, tile types, stateful tiles)
+    _width = obj[0][0]
+    return len(obj[0][1]) // _width, _width
+
 def get_level_from_save_obj(level, obj):
     _map = obj[0]
     _locations = obj[1]
@@ -54,21 +76,28 @@ def get_level_from_save_obj(level, obj):
     _lvl_num = obj[5]
     _player_loc = obj[6]
     _cameras = obj[7]
-    _length = len(_map)
-    _width = len(_map[0])
     _sec_lock = obj[8]
     _subnet_nodes = obj[9]
     _cameras_active = obj[10]
     _security = obj[11]
+    _room_layout = obj[12] if len(obj) > 12 else []
+    _last_turn = obj[13] if len(obj) > 13 else level.dm.turn
     
-    level.map = _map
-    level.dungeon_loc = _locations
+    if is_old_level_save(obj):
+        level.map = _map
+        level.load_old_locs_save_obj(_locations)
+    else:
+        level.load_map_save_obj(_map)
+        level.load_locs_save_obj(_locations)
     level.light_sources = _light_sources
+    level.rebuild_light_map()
     level.cameras = _cameras
     level.security_lockdown = _sec_lock
     level.subnet_nodes = _subnet_nodes
     level.cameras_active = _cameras_active
     level.security_active = _security
+    level.set_room_layout(_room_layout)
+    level.last_turn = _last_turn
     level.player_loc = _player_loc
     level.level_num = _lvl_num
     
@@ -0,0 +1,135 @@
+# Copyright 2010 by Dana Larose
+
+# This file is part of crashRun.
+
+# crashRun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# crashRun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
+
+from random import Random
+from string import digits
+
+from .DungeonMaster import GameOver
+
+# Commands a bot shouldn't stumble into, since they'd end the game or need
+# typed input
+BOT_AVOIDS = ('QUIT', 'SAVE_AND_EXIT', 'DEBUG_COMMAND')
+
+# Keys are read from a script as whitespace separated names, the same names
+# DisplayGuts.wait_for_key_input() hands back ('h', 'return', 'escape', etc),
+# plus 'space' for the space bar.
+def keys_from_script(filename):
+    _file = open(filename, 'r')
+    _names = _file.read().split()
+    _file.close()
+
+    return [' ' if _name == 'space' else _name for _name in _names]
+
+# A bot for soak tests. It mashes keys, mostly the movement keys, for the
+# given number of keystrokes. Throwing in digits and 'return' now and then 
+# gets it through character creation.
+def random_keys(keymap, count, seed=None):
+    _rnd = Random(seed)
+    _moves = [chr(_k) for _k in keymap if keymap[_k].startswith('MOVE_')]
+    _others = [chr(_k) for _k in keymap if not keymap[_k].startswith('MOVE_') and keymap[_k] not in BOT_AVOIDS]
+    _others += ['return', 'return', 'escape', ' ', 'y', 'n'] + list(digits)
+    for _j in range(count):
+        if _rnd.random() < 0.7:
+            yield _rnd.choice(_moves)
+        else:
+            yield _rnd.choice(_others)
+
+# A stand-in for DisplayGuts with no window. Nothing is drawn and nothing
+# waits: keystrokes come from keys (any iterable of key names, so a script
+# or a bot) and once they run out, the game is over. If a transcript (any
+# file-like object) is given, the messages and screens of text the player
+# would have seen are written to it.
+class HeadlessGuts(object):
+    def __init__(self, dr, dc, keys, transcript=None):
+        self.display_rows = dr
+        self.display_cols = dc
+        self.max_cols = dc
+        self.map_r = ''
+        self.map_c = ''
+        self.display_mode = 'standard'
+        self.keys = iter(keys)
+        self.transcript = transcript
+        self.keystrokes = 0
+
+    def __record(self, text):
+        if self.transcript is not None:
+            self.transcript.write(text + '\n')
+
+    def check_screen_pos(self):
+        pass
+
+    def clear_msg_line(self):
+        pass
+
+    def clear_screen(self, fullscreen):
+        pass
+
+    def clear_sidebar(self):
+        pass
+
+    def pause_for_more(self):
+        pass
+
+    def play_animation(self, frames):
+        pass
+
+    def redraw_screen(self):
+        pass
+
+    def set_r_c(self, r, c, level_num):
+        self.map_r = r
+        self.map_c = c
+
+    def show_vision(self, vision):
+        pass
+
+    def switch_to_normal_display(self):
+        self.display_mode = 'standard'
+
+    def switch_to_remote_display(self):
+        self.display_mode = 'remote'
+
+    def write_sidebar(self):
+        pass
+
+    def update_block(self, block):
+        pass
+
+    def update_status_bar(self):
+        pass
+
+    def update_view(self, sqr):
+        pass
+
+    def wait_for_key_input(self):
+        try:
+            _key = next(self.keys)
+        except StopIteration:
+            raise GameOver
+        self.keystrokes += 1
+
+        return _key
+
+    def write_cursor(self, row, col, tile):
+        pass
+
+    def write_message(self, message, pause):
+        self.__record(message)
+
+    def write_screen(self, raw_lines, pause_at_end, allow_esc = False):
+        for _line in raw_lines:
+            self.__record(_line)
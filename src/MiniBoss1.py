@@ -92,6 +92,7 @@ class MiniBoss1Level(GameLevel):
         _stairs = _ncf.upStairs
         self.entrance = (_stairs[0] + 5, _stairs[1] + 5) 
         self.__translate_rooms(_ncf)
+        self.set_room_layout(self.rooms.values())
         
     def __set_east_wall(self):
         _sr = self.length // 2
@@ -157,11 +158,9 @@ class MiniBoss1Level(GameLevel):
 
     def get_exit(self):
         if not self.exit:
-            for r in range(self.lvl_length):
-                for c in range(self.lvl_width):
-                    _sqr = self.map[r][c]
-                    if isinstance(_sqr, SpecialDoor):
-                        return (r, c)
+            _doors = self.find_features(SpecialDoor)
+            if _doors:
+                return _doors[0]
 
     def __get_monster(self):
         _rnd =  randrange(0,23)
@@ -30,6 +30,7 @@ from .Terrain import FLOOR
 from .Terrain import SECURITY_CAMERA
 from .Terrain import TERMINAL
 from .Terrain import UP_STAIRS
+from .RoomGraph import squares_in_rect
 from .TowerFactory import TowerFactory
 from .Util import AudioAlert
 
@@ -154,6 +155,7 @@ class OldComplexLevel(GameLevel):
         self.map = _tower.gen_map()
         self.entrance = _tower.upStairs
         self.exit = _tower.downStairs
+        self.set_room_layout(squares_in_rect(*_room) for _room in _tower.rooms)
 
         self.__bust_up_level()
 
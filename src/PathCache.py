@@ -0,0 +1,95 @@
+# Copyright 2010 by Dana Larose
+
+# This file is part of crashRun.
+
+# crashRun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# crashRun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+
+# Paths found by monsters' A* searches, kept per level so a monster that has 
+# lost its way (usually from bumping into another monster in a corridor) 
+# doesn't have to search all over again. Paths are keyed by start and goal 
+# and only live as long as the level's terrain_version, since any change to 
+# the terrain could make them wrong. The least recently used are dropped once
+# max_entries is reached.
+#
+# A path from A to the goal is also a path from any square along it, so a 
+# monster standing anywhere on a cached path can pick it up from there.
+#
+# Occupants aren't part of the key: they move around too much. Whoever uses 
+# a path checks it's clear and patches around anyone in the way (see 
+# AStarMover).
+#
+# hits count paths handed back whole, repairs the ones that had to be 
+# patched, misses the ones that needed a full search and searched the 
+# squares expanded doing the searches and the patching.
+class PathCache(object):
+    def __init__(self, level, max_entries=64):
+        self.level = level
+        self.max_entries = max_entries
+        self.hits = 0
+        self.repairs = 0
+        self.misses = 0
+        self.searched = 0
+        self.__paths = OrderedDict()
+        self.__on_path = {}
+        self.__version = level.terrain_version
+
+    def clear(self):
+        self.__paths = OrderedDict()
+        self.__on_path = {}
+
+    def __check_version(self):
+        if self.level.terrain_version != self.__version:
+            self.clear()
+            self.__version = self.level.terrain_version
+
+    # The rest of a cached path to goal, starting after start, or None
+    def lookup(self, start, goal):
+        self.__check_version()
+        _key = (start, goal)
+        if _key in self.__paths:
+            self.__paths.move_to_end(_key)
+            return list(self.__paths[_key])
+
+        _found = self.__on_path.get(_key)
+        if _found is None:
+            return None
+
+        _path_key, _pos = _found
+        self.__paths.move_to_end(_path_key)
+        return list(self.__paths[_path_key][_pos + 1:])
+
+    def store(self, start, goal, path):
+        self.__check_version()
+        _key = (start, goal)
+        if _key in self.__paths:
+            self.__forget(_key)
+
+        self.__paths[_key] = tuple(path)
+        for _pos in range(len(path) - 1):
+            self.__on_path[(path[_pos], goal)] = (_key, _pos)
+        if len(self.__paths) > self.max_entries:
+            self.__forget(next(iter(self.__paths)))
+
+    def __forget(self, key):
+        _path = self.__paths.pop(key)
+        _goal = key[1]
+        for _pos in range(len(_path) - 1):
+            if self.__on_path.get((_path[_pos], _goal)) == (key, _pos):
+                del self.__on_path[(_path[_pos], _goal)]
+
+    def hit_rate(self):
+        _total = self.hits + self.repairs + self.misses
+        return float(self.hits + self.repairs) / _total if _total else 0.0
@@ -48,11 +48,9 @@ class ProvingGroundsLevel(GameLevel):
             self.add_monster()
 
     def find_special_floor_loc(self, direction):
-        for r in range(self.lvl_length):
-            for c in range(self.lvl_width):
-                _sqr = self.map[r][c]
-                if isinstance(_sqr, Terrain.SpecialFloor) and _sqr.direction == direction:
-                    return (r, c)
+        for r, c in self.find_features(Terrain.SpecialFloor):
+            if self.map[r][c].direction == direction:
+                return (r, c)
 
     def get_entrance(self):
         if not self.entrance:
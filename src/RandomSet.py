@@ -0,0 +1,56 @@
+# Copyright 2010 by Dana Larose
+
+# This file is part of crashRun.
+
+# crashRun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# crashRun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
+
+from random import randrange
+
+# A set that can also hand back a random member in constant time. The members
+# are kept in a list, along with each one's position in it, and removing a
+# member moves the last one into its spot.
+class RandomSet(object):
+    def __init__(self):
+        self.__items = []
+        self.__positions = {}
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, item):
+        return item in self.__positions
+
+    def __iter__(self):
+        return iter(list(self.__items))
+
+    def add(self, item):
+        if item not in self.__positions:
+            self.__positions[item] = len(self.__items)
+            self.__items.append(item)
+
+    def discard(self, item):
+        _pos = self.__positions.pop(item, None)
+        if _pos is None:
+            return
+
+        _last = self.__items.pop()
+        if _pos < len(self.__items):
+            self.__items[_pos] = _last
+            self.__positions[_last] = _pos
+
+    # Returns None if the set is empty
+    def choice(self):
+        if not self.__items:
+            return None
+        return self.__items[randrange(len(self.__items))]
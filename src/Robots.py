@@ -28,9 +28,9 @@ from .Agent import IllegalMonsterMove
 from .Agent import RelentlessPredator
 from .Agent import Shooter
 from .Agent import Unique
+from .FieldOfView import SYMMETRIC_VISION
 from .Inventory import Inventory
 from . import Items
-from .FieldOfView import Shadowcaster
 
 class BasicBot(RelentlessPredator, AgentMemory):
     bot_number = 0
@@ -75,6 +75,9 @@ class BasicBot(RelentlessPredator, AgentMemory):
                     self.target = self.dm.player
                     self.dm.alert_player(self.row, self.col, "Suspicious robot activity detected!")
 
+    def is_idle(self):
+        return self.attitude == 'shutdown'
+
     def regenerate(self):
         pass # Standard robots don't heal on their own. They need to be repaired.
 
@@ -203,9 +206,8 @@ class CleanerBot(BasicBot):
         d = self.distance_from_player(_loc)
 
         if d < r:
-            sc = Shadowcaster(self.dm, self.vision_radius, self.row, self.col, self.curr_level)
-            mv = sc.calc_visible_list()
-            if _loc in mv:
+            _lvl = self.dm.dungeon_levels[self.curr_level]
+            if _lvl.can_see(self.vision_radius, self.row, self.col, _loc[0], _loc[1], SYMMETRIC_VISION):
                 action()
 
 class DocBot(CleanerBot):    
@@ -338,16 +340,11 @@ class RepairBot(CleanerBot):
                 break
 
     def look_for_patient(self, level):
-        _patients = PriorityQueue()
-        _sc = Shadowcaster(self.dm, self.vision_radius, self.row, self.col, self.curr_level)
-        
-        for _sqr in _sc.calc_visible_list():
-            _occ = level.dungeon_loc[_sqr[0]][_sqr[1]].occupant
-            if self.is_patient(_occ):
-                _patients.push(_occ, calc_distance(self.row,self.col,_sqr[0],_sqr[1]))
+        _visible = level.calc_visible_list(self.vision_radius, self.row, self.col)
+        _patient = level.nearest_agent(self.row, self.col, self.vision_radius,
+                    lambda _a: self.is_patient(_a) and (_a.row, _a.col) in _visible)
                 
-        if len(_patients) > 0:
-            _patient = _patients.pop()
+        if _patient is not None:
             self.move_to((_patient.row, _patient.col))
         else:
             self.move()
@@ -537,6 +534,10 @@ class Roomba3000(Roomba, Unique):
     def killed(self, dm, killer):
         Unique.killed(self, dm)
         super(Roomba, self).killed(dm, killer)
+
+    # Shutting him down doesn't stop him vacuuming
+    def is_idle(self):
+        return False
         
     def perform_action(self):
         _tp = self.dm.get_true_player()
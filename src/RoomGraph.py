@@ -0,0 +1,216 @@
+# Copyright 2010 by Dana Larose
+
+# This file is part of crashRun.
+
+# crashRun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# crashRun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+from collections import deque
+from heapq import heappop
+from heapq import heappush
+
+NEIGHBOURS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+# For generators that carve out rectangular rooms
+def squares_in_rect(row, col, height, width):
+    return [(_r, _c) for _r in range(row, row + height) for _c in range(col, col + width)]
+
+# A level boiled down to its rooms and the ways between them, for planning 
+# long trips without searching square by square (hierarchical A*, more or 
+# less). The rooms come from the level generator, as lists of squares. Any
+# walkable squares left over (hallways, doorways, rubble) are split into 
+# connected areas that count as rooms too.
+#
+# Wherever two areas touch there's a crossing: a square on each side, picked
+# from the middle of the stretch where they meet. The crossings are the nodes 
+# of the graph. Crossings on opposite sides of the same meeting are a step 
+# apart, and crossings in the same area are joined by how many steps it takes
+# to walk between them without leaving the area.
+#
+# The graph is worked out from the terrain when it's built, so the level 
+# builds a new one after the terrain changes.
+class RoomGraph(object):
+    def __init__(self, level, rooms):
+        self.width = level.layer_width
+        self.length = level.layer_length
+        self.areas = array('i', [-1]) * (self.width * self.length)
+        self.edges = {}
+        self.__walkable = [_p > _t for _p, _t in zip(level.passable, level.toxic)]
+        self.__count = 0
+
+        for _room in rooms:
+            self.__add_room(_room)
+        for _i in range(len(self.areas)):
+            if self.__walkable[_i] and self.areas[_i] == -1:
+                self.__add_leftover_area(_i)
+
+        self.__find_crossings()
+        self.__join_crossings()
+
+    def __neighbours(self, i):
+        _r, _c = divmod(i, self.width)
+        for _dr, _dc in NEIGHBOURS:
+            _nr = _r + _dr
+            _nc = _c + _dc
+            if 0 <= _nr < self.length and 0 <= _nc < self.width:
+                yield _nr * self.width + _nc
+
+    def __add_room(self, squares):
+        _added = False
+        for _r, _c in squares:
+            if 0 <= _r < self.length and 0 <= _c < self.width:
+                _i = _r * self.width + _c
+                if self.__walkable[_i] and self.areas[_i] == -1:
+                    self.areas[_i] = self.__count
+                    _added = True
+        if _added:
+            self.__count += 1
+
+    def __add_leftover_area(self, start):
+        _area = self.__count
+        self.__count += 1
+        self.areas[start] = _area
+        _queue = deque([start])
+        while _queue:
+            for _j in self.__neighbours(_queue.popleft()):
+                if self.__walkable[_j] and self.areas[_j] == -1:
+                    self.areas[_j] = _area
+                    _queue.append(_j)
+
+    def __find_crossings(self):
+        _borders = {}
+        for _i in range(len(self.areas)):
+            _area = self.areas[_i]
+            if _area == -1:
+                continue
+            for _j in self.__neighbours(_i):
+                if self.areas[_j] not in (-1, _area):
+                    _borders.setdefault((_area, self.areas[_j]), set()).add(_i)
+
+        for (_area, _other), _sqrs in _borders.items():
+            for _stretch in self.__split_stretches(_sqrs):
+                _crossing = self.__middle(_stretch)
+                _across = min(_j for _j in self.__neighbours(_crossing) if self.areas[_j] == _other)
+                self.__join(_crossing, _across, 1)
+
+    # Break a set of border squares up into runs of touching squares
+    def __split_stretches(self, sqrs):
+        _left = set(sqrs)
+        while _left:
+            _stretch = [_left.pop()]
+            _queue = deque(_stretch)
+            while _queue:
+                for _j in self.__neighbours(_queue.popleft()):
+                    if _j in _left:
+                        _left.remove(_j)
+                        _stretch.append(_j)
+                        _queue.append(_j)
+            yield _stretch
+
+    def __middle(self, stretch):
+        _sqrs = sorted(stretch)
+        return _sqrs[len(_sqrs) // 2]
+
+    def __join(self, a, b, cost):
+        _edges = self.edges.setdefault(a, {})
+        if b not in _edges or cost < _edges[b]:
+            _edges[b] = cost
+            self.edges.setdefault(b, {})[a] = cost
+
+    def __join_crossings(self):
+        _by_area = {}
+        for _node in self.edges:
+            _by_area.setdefault(self.areas[_node], []).append(_node)
+
+        for _nodes in _by_area.values():
+            for _node in _nodes:
+                _steps = self.steps_within_area(_node)
+                for _other in _nodes:
+                    if _other != _node and _other in _steps:
+                        self.__join(_node, _other, _steps[_other])
+
+    # Steps from square i to each crossing in its area, staying in the area
+    def steps_within_area(self, i):
+        _area = self.areas[i]
+        _dist = {i:0}
+        _found = {}
+        _queue = deque([i])
+        while _queue:
+            _sqr = _queue.popleft()
+            if _sqr in self.edges:
+                _found[_sqr] = _dist[_sqr]
+            for _j in self.__neighbours(_sqr):
+                if _j not in _dist and self.areas[_j] == _area:
+                    _dist[_j] = _dist[_sqr] + 1
+                    _queue.append(_j)
+
+        return _found
+
+    def __estimate(self, i, goal):
+        _r, _c = divmod(i, self.width)
+        return max(abs(_r - goal[0]), abs(_c - goal[1]))
+
+    # The crossings to head for, in order, to get from start to goal. None if
+    # they're in the same area (so there's nothing to plan), or an empty list 
+    # if there's no way to get there.
+    def route(self, start, goal):
+        _start = start[0] * self.width + start[1]
+        _goal = goal[0] * self.width + goal[1]
+        if self.areas[_start] == -1 or self.areas[_goal] == -1:
+            return None
+        if self.areas[_start] == self.areas[_goal]:
+            return None
+
+        _to_goal = self.steps_within_area(_goal)
+        _came_from = {}
+        _best = {}
+        _open = []
+        for _node, _steps in self.steps_within_area(_start).items():
+            _best[_node] = _steps
+            _came_from[_node] = None
+            heappush(_open, (_steps + self.__estimate(_node, goal), _steps, _node))
+
+        _closed = set()
+        while _open:
+            _f, _g, _node = heappop(_open)
+            if _node == -1:
+                return self.__waypoints(_came_from, _came_from[-1])
+            if _node in _closed:
+                continue
+            _closed.add(_node)
+
+            if _node in _to_goal:
+                _total = _g + _to_goal[_node]
+                if -1 not in _best or _total < _best[-1]:
+                    _best[-1] = _total
+                    _came_from[-1] = _node
+                    heappush(_open, (_total, _total, -1))
+
+            for _next, _cost in self.edges[_node].items():
+                _next_g = _g + _cost
+                if _next not in _closed and (_next not in _best or _next_g < _best[_next]):
+                    _best[_next] = _next_g
+                    _came_from[_next] = _node
+                    heappush(_open, (_next_g + self.__estimate(_next, goal), _next_g, _next))
+
+        return []
+
+    def __waypoints(self, came_from, node):
+        _route = []
+        while node is not None:
+            _route.append(divmod(node, self.width))
+            node = came_from[node]
+        _route.reverse()
+
+        return _route
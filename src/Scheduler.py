@@ -0,0 +1,184 @@
+# Copyright 2010 by Dana Larose
+
+# This file is part of crashRun.
+
+# crashRun is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# crashRun is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with crashRun.  If not, see <http://www.gnu.org/licenses/>.
+
+from heapq import heappop
+from heapq import heappush
+
+BETWEEN_TICKS = 0
+ACTING = 1
+ENDING = 2
+
+# Bookkeeping for one agent. Its energy is only written back when it acts
+# or its speed changes; in between, its energy at the start of tick t is
+# energy + gain * (t - base).
+class _Turns(object):
+    __slots__ = ('seq', 'base', 'gain', 'due', 'version', 'visited')
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.base = 0
+        self.gain = 0
+        self.due = None
+        self.version = 0
+        self.visited = False
+
+# Works out which of a level's monsters get a turn on each tick, so the
+# dungeon master doesn't have to sweep every monster on the level to find the
+# handful with enough energy to act. Each monster sits in a heap under the
+# tick it'll next have ENERGY_THRESHOLD energy, which is simple to work out
+# since energy goes up by the same amount every turn until the monster's
+# speed changes. Monsters that come due on the same tick go in the order they
+# were added to the level, same as walking the level's monster list.
+#
+# The clock only moves when the level is being simulated, so a level the
+# player isn't on stays frozen, same as before.
+class Scheduler(object):
+    def __init__(self):
+        self.clock = 0
+        self.__phase = BETWEEN_TICKS
+        self.__queue = []
+        self.__ready = []
+        self.__turns = {}
+        self.__seq = 0
+        self.__cursor = -1
+        self.__visited = []
+
+    def __len__(self):
+        return len(self.__turns)
+
+    def __contains__(self, agent):
+        return agent in self.__turns
+
+    def __iter__(self):
+        return iter(list(self.__turns))
+
+    def add(self, agent):
+        if agent in self.__turns:
+            return
+        _t = _Turns(self.__seq)
+        self.__seq += 1
+        # Something added while monsters are acting gets its turn this tick,
+        # anything else starts with the next one.
+        _t.base = self.clock if self.__phase == ACTING else self.clock + 1
+        _t.gain = self.__gain(agent)
+        self.__turns[agent] = _t
+        self.__push(agent, _t)
+
+    def remove(self, agent):
+        _t = self.__turns.pop(agent, None)
+        if _t is not None and not _t.visited:
+            self.__settle(agent, _t)
+
+    # Called when something changes how soon an agent gets to act (its speed
+    # went up or down, or it was stunned)
+    def reschedule(self, agent):
+        _t = self.__turns.get(agent, None)
+        if _t is None or _t.visited:
+            # Agents that have already had their turn this tick get sorted
+            # out when the tick ends
+            return
+        self.__settle(agent, _t)
+        _t.gain = self.__gain(agent)
+        self.__push(agent, _t)
+
+    # Write everyone's energy back to the agents themselves (say, before the
+    # level is saved)
+    def settle_all(self):
+        for _agent, _t in self.__turns.items():
+            if not _t.visited:
+                self.__settle(_agent, _t)
+
+    # Starts the next tick and returns the agents due to act in it (so far;
+    # something can speed up or arrive partway through)
+    def begin_tick(self):
+        self.clock += 1
+        self.__phase = ACTING
+        self.__cursor = -1
+        _queue = self.__queue
+        while _queue and _queue[0][0] <= self.clock:
+            _due, _seq, _version, _agent = heappop(_queue)
+            heappush(self.__ready, (_seq, _version, _agent))
+
+        return [_entry[2] for _entry in sorted(self.__ready) if self.__current(_entry)]
+
+    # The next agent to act this tick, with its energy brought up to date, or 
+    # None once everyone due has had their turn
+    def next_turn(self):
+        while self.__ready:
+            _entry = heappop(self.__ready)
+            if not self.__current(_entry):
+                continue
+            _agent = _entry[2]
+            _t = self.__turns[_agent]
+            self.__settle(_agent, _t)
+            _t.visited = True
+            self.__cursor = _t.seq
+            self.__visited.append(_agent)
+            return _agent
+
+        self.__phase = ENDING
+        return None
+
+    # Everyone who had a turn gets their energy for the tick and goes back
+    # in the queue
+    def end_tick(self):
+        for _agent in self.__visited:
+            _t = self.__turns.get(_agent, None)
+            if _t is None:
+                continue
+            _t.visited = False
+            _t.gain = self.__gain(_agent)
+            _agent.energy += _t.gain
+            _t.base = self.clock + 1
+            self.__push(_agent, _t)
+        self.__visited = []
+        self.__phase = BETWEEN_TICKS
+
+    def __current(self, entry):
+        _t = self.__turns.get(entry[2], None)
+        return _t is not None and _t.version == entry[1] and not _t.visited
+
+    def __gain(self, agent):
+        return agent.base_energy + agent.sum_effect_bonuses('speed')
+
+    # Brings the agent's energy up to the start of the current tick (or the
+    # next one, between ticks) and starts counting from there
+    def __settle(self, agent, turns):
+        _now = self.clock if self.__phase != BETWEEN_TICKS else self.clock + 1
+        if _now > turns.base:
+            agent.energy += turns.gain * (_now - turns.base)
+            turns.base = _now
+
+    def __push(self, agent, turns):
+        turns.version += 1
+        if agent.has_condition('stunned') or agent.energy >= agent.ENERGY_THRESHOLD:
+            turns.due = turns.base
+        elif turns.gain > 0:
+            _short = agent.ENERGY_THRESHOLD - agent.energy
+            turns.due = turns.base + (_short + turns.gain - 1) // turns.gain
+        else:
+            # Won't ever get a turn unless its speed changes
+            turns.due = None
+            return
+
+        if self.__phase == ACTING and turns.due <= self.clock:
+            if turns.seq > self.__cursor:
+                heappush(self.__ready, (turns.seq, turns.version, agent))
+                return
+            # The monsters have already gone past this one this tick
+            turns.due = self.clock + 1
+        heappush(self.__queue, (turns.due, turns.seq, turns.version, agent))
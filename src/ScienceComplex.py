@@ -45,6 +45,7 @@ class ScienceComplexLevel(GameLevel):
     def __generate_map(self):
         self._ncf = NewComplexFactory(self.lvl_length, self.lvl_width, False, False)
         self.map = self._ncf.gen_map()
+        self.set_room_layout(self._ncf.rooms.values())
         self._ncf.remove_up_stairs_from_rooms()
         self.upStairs = self._ncf.upStairs
         self.downStairs = self._ncf.downStairs
@@ -18,7 +18,6 @@
 from random import randrange
 
 from .BaseTile import BaseTile
-from .FieldOfView import Shadowcaster
 from .Items import ItemFactory
 from .MessageResolver import MessageResolver
 from .Util import VisualAlert
@@ -166,8 +165,8 @@ class Terminal(Equipment):
         self.access(dm, _dui)
  
     def show_camera_feed(self, camera, dm, dui):
-        sc = Shadowcaster(dm, camera.camera_range, camera.row, camera.col, dm.player.curr_level)
-        feed = sc.calc_visible_list()
+        _lvl = dm.dungeon_levels[dm.player.curr_level]
+        feed = dict(_lvl.calc_visible_list(camera.camera_range, camera.row, camera.col))
         feed[(camera.row, camera.col)] = 0
 
         vision = []
@@ -262,6 +261,7 @@ class Door(TerrainTile):
         if self.damagePoints < 1:
             dm.update_sqr(level, row, col)
             self.smash()
+            level.terrain_changed(row, col)
             _msg = self.get_name() + ' is blown to pieces.'
             alert = VisualAlert(row, col, _msg, '')
             alert.show_alert(dm, False)
@@ -348,9 +348,14 @@ class HoleInCeiling(Trap):
             dm.alert_player(row, col, "There is a hole in the ceiling above you.")
             
 class TerrainFactory:
+    # The plain tiles don't carry any state, so every factory shares one set
+    # of them and a level only needs to remember which type is in a square.
+    __terrain_cache = {}
+
     def __init__(self):
-        self.__terrain_cache = {}
-        
+        if self.__terrain_cache:
+            return
+
         self.__terrain_cache[PERM_WALL] = TerrainTile('#','darkgrey','black','grey',0,1,0,0,'wall',PERM_WALL)
         self.__terrain_cache[WALL] = TerrainTile('#','darkgrey','black','grey',0,1,0,0,'wall',WALL)
         self.__terrain_cache[FLOOR] = TerrainTile('.','grey','black','yellow',1,0,1,0,'floor',FLOOR)
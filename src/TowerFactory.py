@@ -62,6 +62,7 @@ class TowerFactory(object):
     
     def reset_map(self):
         self.map = []
+        self.rooms = []
         # start the map off all floors
         for r in range(self.__length):
             row = []
@@ -365,6 +366,9 @@ class TowerFactory(object):
 
     def __split_map(self,start_r,start_c,length,width):
         if length * width <= self.__min_size:
+            # This section is a room. (Offset by one for the border that gets
+            # drawn around the map at the end)
+            self.rooms.append((start_r + 1, start_c + 1, length, width))
             return
         
         # A more clever/interesting way would be to pick an H or V split with 
@@ -22,6 +22,7 @@ from .Terrain import PERM_WALL
 from .Terrain import UP_STAIRS
 from .Terrain import DOWN_STAIRS
 from .Terrain import OCEAN
+from random import choice
 from random import randrange
 from .DisjointSet import DSNode
 from .DisjointSet import union
@@ -197,15 +198,15 @@ class CA_CaveFactory:
 
         return (h_dir,v_dir)
 
+    # The down stairs go somewhere off the edge of the map, the up stairs on 
+    # any other floor square. (A cave always has plenty of floor to pick from)
     def add_stairs(self, set_stairs):
-        while 1:
-            dr = randrange(1,self.__length-1)
-            dc = randrange(1,self.__width-1)
-            ur = randrange(0,self.__length)
-            uc = randrange(0,self.__width)
-        
-            if (dr,dc) != (ur,uc) and self.map[dr][dc].get_type() == FLOOR and self.map[ur][uc].get_type() == FLOOR:
-                break
+        _floors = [(r, c) for r in range(self.__length) for c in range(self.__width) 
+                        if self.map[r][c].get_type() == FLOOR]
+        _interior = [_f for _f in _floors if 0 < _f[0] < self.__length-1 and 0 < _f[1] < self.__width-1]
+        dr, dc = choice(_interior)
+        _floors.remove((dr, dc))
+        ur, uc = choice(_floors)
 
         if len(set_stairs) == 0:
             _up = True